@@ -0,0 +1,168 @@
+"""Measure the CPU/bandwidth trade-off of compressing typical Odoo responses.
+
+Run it with `python scripts/bench_compress.py`. It compresses synthetic samples
+of the responses Odoo serves most, with the encodings Traefik supports, and
+prints the bytes and network packets saved against the CPU time spent.
+
+Pass paths of real responses, saved with `curl -o`, to benchmark them too.
+Brotli and zstd are only measured if the `brotli` and `zstandard` packages
+are installed.
+
+Use the results to tune `traefik_compress_min_bytes` and
+`traefik_compress_excluded_content_types`.
+"""
+
+import argparse
+import gzip
+import json
+import math
+import os
+import random
+import time
+import zlib
+from pathlib import Path
+
+# Usual TCP payload of a packet in an Ethernet network
+PACKET_BYTES = 1400
+
+
+def _samples():
+    """Generate responses similar to those that Odoo serves."""
+    rnd = random.Random(0)
+    words = [
+        "partner",
+        "invoice",
+        "sale",
+        "order",
+        "product",
+        "stock",
+        "move",
+        "account",
+        "journal",
+        "line",
+    ]
+
+    def name():
+        return " ".join(rnd.choice(words).title() for _ in range(3))
+
+    def records(amount):
+        return [
+            {
+                "id": rnd.randint(1, 99999),
+                "name": name(),
+                "amount_total": round(rnd.uniform(0, 10000), 2),
+                "partner_id": [rnd.randint(1, 999), name()],
+                "state": rnd.choice(["draft", "sale", "done", "cancel"]),
+            }
+            for _ in range(amount)
+        ]
+
+    def rpc(result):
+        return json.dumps({"jsonrpc": "2.0", "id": 7, "result": result}).encode()
+
+    def stream(size):
+        # Already compressed streams look like random bytes
+        return os.urandom(size)
+
+    html = "".join(
+        f'<tr class="o_data_row"><td class="o_data_cell">{name()}</td>'
+        f'<td class="o_data_cell o_list_number">{rnd.randint(0, 9999)}.00</td></tr>'
+        for _ in range(150)
+    )
+    js = "".join(
+        f"odoo.define('{rnd.choice(words)}.{i}', function (require) {{\n"
+        f"    const {{ Component }} = owl;\n"
+        f"    class Widget{i} extends Component {{\n"
+        f"        setup() {{ this.state = useState({{ {rnd.choice(words)}: {i} }}); }}\n"
+        f"    }}\n    return Widget{i};\n}});\n"
+        for i in range(6000)
+    )
+    pdf = b"%PDF-1.4\n" + b"".join(
+        b"<< /Filter /FlateDecode >>\nstream\n"
+        + zlib.compress(os.urandom(2048) + name().encode() * 100)
+        + b"\nendstream\n"
+        for _ in range(40)
+    )
+    return {
+        "JSON-RPC, read 1 record": rpc(records(1)),
+        "JSON-RPC, bus poll": rpc([]),
+        "JSON-RPC, search_read 80": rpc(records(80)),
+        "Website page": f"<html><body><table>{html}</table>".encode(),
+        "Asset bundle": js.encode(),
+        "PDF report": pdf,
+        "JPEG image": stream(80_000),
+        "XLSX export": stream(300_000),
+    }
+
+
+def _encoders():
+    """Get compressors at the fast levels that reverse proxies use."""
+    result = {"gzip": lambda data: gzip.compress(data, compresslevel=6)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        result["br"] = lambda data: brotli.compress(data, quality=4)
+    try:
+        import zstandard
+    except ImportError:
+        pass
+    else:
+        compressor = zstandard.ZstdCompressor(level=3)
+        result["zstd"] = compressor.compress
+    return result
+
+
+def _measure(encoder, data, min_seconds):
+    """Compress data until enough time passes; return size and seconds per run."""
+    runs, start = 0, time.process_time()
+    while True:
+        compressed = encoder(data)
+        runs += 1
+        elapsed = time.process_time() - start
+        if elapsed >= min_seconds:
+            return len(compressed), elapsed / runs
+
+
+def _packets(size):
+    return math.ceil(size / PACKET_BYTES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", type=Path, help="Real responses")
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.2,
+        help="CPU time to spend measuring each sample and encoding",
+    )
+    args = parser.parse_args()
+    samples = _samples()
+    for path in args.files:
+        samples[path.name] = path.read_bytes()
+    header = (
+        f"{'Response':<26} {'Enc':<5} {'Bytes':>9} {'Compr.':>9} {'Ratio':>6} "
+        f"{'Packets':>9} {'CPU µs':>9} {'KiB saved/CPU ms':>17}"
+    )
+    print(header)
+    print("-" * len(header))
+    for label, data in samples.items():
+        for encoding, encoder in _encoders().items():
+            size, seconds = _measure(encoder, data, args.min_seconds)
+            saved_kib = (len(data) - size) / 1024
+            print(
+                f"{label:<26} {encoding:<5} {len(data):>9} {size:>9} "
+                f"{size / len(data):>6.2f} "
+                f"{_packets(len(data)):>4}→{_packets(size):<4} "
+                f"{seconds * 1e6:>9.1f} {saved_kib / (seconds * 1e3):>17.1f}"
+            )
+    print(
+        "\nResponses that fit in one packet gain nothing from compression. "
+        "Already compressed formats cost CPU and save almost no bytes."
+    )
+
+
+if __name__ == "__main__":
+    main()
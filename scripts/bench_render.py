@@ -0,0 +1,85 @@
+"""Measure how long this template takes to render for many domain groups.
+
+Run it with `python scripts/bench_render.py`. It renders this template with
+increasing amounts of production and test domain groups, like those of a
+multi-company project, and prints the best time of some runs for each amount.
+
+Pass `--ref` several times to compare git refs, like a release tag and `HEAD`.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from copier import run_copy
+
+TEMPLATE = Path(__file__).parent.parent
+
+
+def _domains(companies):
+    """Generate domain groups: main, redirected and path-prefixed ones."""
+    result = []
+    for index in range(companies):
+        host = f"company{index}.example.com"
+        result += [
+            {"hosts": [host, f"shop.{host}"]},
+            {"hosts": [f"www.{host}"], "redirect_to": host},
+            {"hosts": [host], "path_prefixes": ["/api", "/portal/"]},
+        ]
+    return result
+
+
+def _render_seconds(ref, domains, traefik_version):
+    """Render the template once and return how long it took."""
+    with tempfile.TemporaryDirectory() as dst:
+        start = time.perf_counter()
+        run_copy(
+            str(TEMPLATE),
+            dst,
+            data={
+                "domains_prod": domains,
+                "domains_test": domains,
+                "traefik_version": traefik_version,
+            },
+            vcs_ref=ref,
+            defaults=True,
+            overwrite=True,
+            unsafe=True,
+            skip_tasks=True,
+            quiet=True,
+        )
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--companies",
+        type=int,
+        nargs="+",
+        default=[0, 50, 200],
+        help="Amounts of companies to render, with 3 domain groups each",
+    )
+    parser.add_argument(
+        "--ref",
+        action="append",
+        help="Git refs to compare; by default, HEAD with uncommitted changes",
+    )
+    parser.add_argument("--runs", type=int, default=3, help="Renders per case")
+    parser.add_argument("--traefik-version", type=int, choices=(1, 2, 3), default=3)
+    args = parser.parse_args()
+    refs = args.ref or ["HEAD"]
+    print(f"{'Ref':<20} {'Companies':>9} {'Groups':>7} {'Seconds':>8}")
+    for ref in refs:
+        for companies in args.companies:
+            domains = _domains(companies)
+            seconds = min(
+                _render_seconds(ref, domains, args.traefik_version)
+                for _ in range(args.runs)
+            )
+            print(f"{ref:<20} {companies:>9} {len(domains):>7} {seconds:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
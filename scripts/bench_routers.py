@@ -0,0 +1,219 @@
+"""Measure how many Traefik routers production gets for many domain groups.
+
+Run it with `python scripts/bench_routers.py --groups 200`. It renders this
+template for that many domain groups, with and without `traefik_merge_routers`,
+and counts the routers and middlewares in the production labels.
+
+Pass `--traefik path/to/traefik` to also load those routers in a local Traefik
+binary, through its file provider, and measure how long it takes to load them
+and to match requests. Use a binary of the major version in `--traefik-version`.
+"""
+
+import argparse
+import http.client
+import json
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+from copier import run_copy
+
+TEMPLATE = Path(__file__).parent.parent
+# Label values that Traefik splits by commas
+LIST_FIELDS = {
+    "encodings",
+    "entrypoints",
+    "excludedContentTypes",
+    "middlewares",
+    "prefixes",
+    "sourceRange",
+}
+
+
+def _domains(groups, redirects):
+    """Generate domain groups of a multi-company production."""
+    result = []
+    for index in range(groups):
+        host = f"company{index}.example.com"
+        result.append({"hosts": [host]})
+        if redirects:
+            result.append({"hosts": [f"www.{host}"], "redirect_to": host})
+    return result
+
+
+def _render(domains, traefik_version, merge):
+    """Render production labels of the Odoo container."""
+    with tempfile.TemporaryDirectory() as dst:
+        run_copy(
+            str(TEMPLATE),
+            dst,
+            data={
+                "domains_prod": domains,
+                "traefik_merge_routers": merge,
+                "traefik_version": traefik_version,
+            },
+            vcs_ref="HEAD",
+            defaults=True,
+            overwrite=True,
+            unsafe=True,
+            skip_tasks=True,
+            quiet=True,
+        )
+        prod = yaml.safe_load((Path(dst) / "prod.yaml").read_text())
+    return prod["services"]["odoo"]["labels"]
+
+
+def _dynamic_config(labels):
+    """Convert Traefik 2+ labels to file provider configuration."""
+    config = {}
+    for label, value in labels.items():
+        if not label.startswith("traefik.http."):
+            continue
+        *path, leaf = label.split(".")[1:]
+        if leaf in LIST_FIELDS:
+            value = [item.strip() for item in str(value).split(",")]
+        node = config
+        for part in path:
+            # Labels like `tls: "true"` just enable options that others set
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        if value == "true" and isinstance(node.get(leaf), dict):
+            continue
+        node[leaf] = {} if value == "true" and leaf == "tls" else value
+    http_config = config.get("http", {})
+    for router in http_config.get("routers", {}).values():
+        # Plain HTTP is enough to match rules; no certificates are needed
+        router["entrypoints"] = ["web"]
+        if isinstance(router.get("tls"), dict):
+            router["tls"].pop("certResolver", None)
+    for service in http_config.get("services", {}).values():
+        service["loadbalancer"] = {"servers": [{"url": "http://127.0.0.1:9"}]}
+    return config
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _routers_count(api_port):
+    """Get how many routers Traefik has loaded, according to its API."""
+    conn = http.client.HTTPConnection("127.0.0.1", api_port, timeout=5)
+    try:
+        conn.request("GET", "/api/http/routers?per_page=1")
+        response = conn.getresponse()
+        response.read()
+        return int(response.getheader("X-Total-Count", 0))
+    finally:
+        conn.close()
+
+
+def _benchmark_traefik(binary, config, hosts, requests):
+    """Load the config in a local Traefik; return load seconds and match times."""
+    workdir = Path(tempfile.mkdtemp())
+    web_port, api_port = _free_port(), _free_port()
+    dynamic = workdir / "dynamic.yaml"
+    dynamic.write_text("{}")
+    static = workdir / "traefik.yaml"
+    static.write_text(
+        yaml.safe_dump(
+            {
+                "api": {"insecure": True},
+                "entryPoints": {
+                    "traefik": {"address": f"127.0.0.1:{api_port}"},
+                    "web": {"address": f"127.0.0.1:{web_port}"},
+                },
+                "log": {"level": "ERROR"},
+                "providers": {
+                    "file": {"filename": str(dynamic), "watch": True},
+                    "providersThrottleDuration": "0s",
+                },
+            }
+        )
+    )
+    process = subprocess.Popen([binary, f"--configFile={static}"])
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                baseline = _routers_count(api_port)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        expected = baseline + len(config.get("http", {}).get("routers", {}))
+        # Replace the file atomically, so Traefik never reads half of it
+        tmp = workdir / "dynamic.tmp"
+        tmp.write_text(yaml.safe_dump(config))
+        start = time.monotonic()
+        tmp.replace(dynamic)
+        while _routers_count(api_port) < expected:
+            if time.monotonic() - start > 60:
+                raise TimeoutError("Traefik didn't load all routers")
+            time.sleep(0.01)
+        load_seconds = time.monotonic() - start
+        # Requests get redirected to HTTPS, so no backend is needed
+        conn = http.client.HTTPConnection("127.0.0.1", web_port, timeout=5)
+        timings = []
+        for _ in range(requests):
+            conn.request("GET", "/shop", headers={"Host": random.choice(hosts)})
+            start = time.perf_counter()
+            response = conn.getresponse()
+            response.read()
+            timings.append(time.perf_counter() - start)
+        conn.close()
+        return load_seconds, timings
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--groups", type=int, default=200, help="Domain groups")
+    parser.add_argument(
+        "--redirects",
+        action="store_true",
+        help="Add a www domain that redirects to each group",
+    )
+    parser.add_argument("--traefik", help="Path to a local Traefik binary")
+    parser.add_argument("--traefik-version", type=int, choices=(2, 3), default=3)
+    parser.add_argument(
+        "--requests", type=int, default=2000, help="Requests to measure matching"
+    )
+    args = parser.parse_args()
+    domains = _domains(args.groups, args.redirects)
+    hosts = [host for group in domains for host in group["hosts"]]
+    results = {}
+    for merge in (False, True):
+        labels = _render(domains, args.traefik_version, merge)
+        config = _dynamic_config(labels)
+        result = results["merged" if merge else "separate"] = {
+            "routers": len(config["http"]["routers"]),
+            "middlewares": len(config["http"].get("middlewares", {})),
+        }
+        if args.traefik:
+            load_seconds, timings = _benchmark_traefik(
+                args.traefik, config, hosts, args.requests
+            )
+            timings.sort()
+            result.update(
+                load_seconds=round(load_seconds, 3),
+                match_p50_us=round(statistics.median(timings) * 1e6),
+                match_p95_us=round(timings[int(len(timings) * 0.95)] * 1e6),
+            )
+    print(json.dumps({"groups": len(domains), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,23 @@ This file is to be executed with https://www.pyinvoke.org/ in Python 3.8.1+.
 Contains common helpers to develop using this child project.
 """
 
+import asyncio
+import base64
+import contextlib
 import json
 import os
+import pstats
+import re
+import shlex
 import shutil
 import stat
 import subprocess
 import tempfile
 import time
-from datetime import datetime
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
 from glob import iglob
 from itertools import chain
 from logging import getLogger
@@ -28,6 +37,8 @@ except ImportError:
 
 PROJECT_ROOT = Path(__file__).parent.absolute()
 SRC_PATH = PROJECT_ROOT / "odoo" / "custom" / "src"
+# Mounted in the devel odoo container as /opt/odoo/auto/profiles
+PROFILES_PATH = PROJECT_ROOT / "odoo" / "auto" / "profiles"
 UID_ENV = {
     "GID": os.environ.get("DOODBA_GID", str(os.getgid())),
     "UID": os.environ.get("DOODBA_UID", str(os.getuid())),
@@ -65,7 +76,7 @@ DOCKER_COMPOSE_CMD = (
 _logger = getLogger(__name__)
 
 
-def _override_docker_command(service, command, file, orig_file=None):
+def _override_docker_command(service, command, file, orig_file=None, environment=None):
     # Read config from main file
     if orig_file:
         with open(orig_file) as fd:
@@ -76,6 +87,8 @@ def _override_docker_command(service, command, file, orig_file=None):
     docker_config = {
         "services": {service: {"command": command}},
     }
+    if environment:
+        docker_config["services"][service]["environment"] = environment
     if not docker_compose_v2 and docker_compose_file_version:
         docker_config["version"] = docker_compose_file_version
     docker_config_yaml = yaml.dump(docker_config)
@@ -83,16 +96,176 @@ def _override_docker_command(service, command, file, orig_file=None):
     file.flush()
 
 
-def _remove_auto_reload(file, orig_file):
+def _remove_auto_reload(file, orig_file, command_prefix=(), environment=None):
     with open(orig_file) as fd:
         orig_docker_config = yaml.safe_load(fd.read())
     odoo_command = orig_docker_config["services"]["odoo"]["command"]
-    new_odoo_command = []
+    new_odoo_command = list(command_prefix)
     for flag in odoo_command:
         if flag.startswith("--dev"):
             flag = flag.replace("reload,", "")
         new_odoo_command.append(flag)
-    _override_docker_command("odoo", new_odoo_command, file, orig_file=orig_file)
+    _override_docker_command(
+        "odoo",
+        new_odoo_command,
+        file,
+        orig_file=orig_file,
+        environment=environment,
+    )
+
+
+# Routes bus requests to the gevent port, like the production proxy does
+_PROD_LIKE_NGINX_CONF = """\
+map $http_upgrade $connection_upgrade {
+    default upgrade;
+    '' close;
+}
+server {
+    listen 8069;
+    client_max_body_size 0;
+    proxy_read_timeout 720s;
+    proxy_set_header Host $http_host;
+    proxy_set_header X-Forwarded-For $remote_addr;
+    proxy_set_header X-Forwarded-Host $http_host;
+    proxy_set_header X-Forwarded-Proto $scheme;
+    location ~ ^/(websocket|longpolling) {
+        proxy_pass http://odoo:8072;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection $connection_upgrade;
+    }
+    location / {
+        proxy_pass http://odoo:8069;
+    }
+}
+server {
+    listen 8072;
+    proxy_read_timeout 720s;
+    location / {
+        proxy_pass http://odoo:8072;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection $connection_upgrade;
+    }
+}
+"""
+# Odoo defaults for production limits
+_PROD_LIKE_LIMITS = {
+    "--limit-memory-soft": "2147483648",
+    "--limit-memory-hard": "2684354560",
+    "--limit-time-cpu": "60",
+    "--limit-time-real": "120",
+    "--max-cron-threads": "2",
+}
+# Production flags that point to services that development doesn't have
+_PROD_ONLY_FLAGS = {"--db_replica_host", "--db_replica_port"}
+
+
+def _prod_like_override(file, orig_file, workers=None):
+    """Override devel services to behave like production."""
+    with open(orig_file) as fd:
+        orig_docker_config = yaml.safe_load(fd.read())
+    with open(PROJECT_ROOT / "prod.yaml") as fd:
+        prod_config = yaml.safe_load(fd.read())["services"]
+    with open(PROJECT_ROOT / "common.yaml") as fd:
+        common_config = yaml.safe_load(fd.read())["services"]
+    # Use production flags, if any, and complete them with Odoo defaults
+    flags = dict(_PROD_LIKE_LIMITS)
+    for flag in prod_config["odoo"].get("command", [])[1:]:
+        key, _sep, value = flag.partition("=")
+        if key not in _PROD_ONLY_FLAGS:
+            flags[key] = value
+    if workers is not None or "--workers" not in flags:
+        flags["--workers"] = str(workers or 2)
+    command = ["odoo"] + [
+        f"{key}={value}" if value else key for key, value in flags.items()
+    ]
+    docker_config = {
+        "services": {
+            "odoo": {
+                "command": command,
+                "environment": {"PROXY_MODE": "true"},
+            },
+            "odoo_proxy": {
+                "image": "docker.io/library/nginx:alpine",
+                "entrypoint": [
+                    "sh",
+                    "-c",
+                    'printf %s "$$NGINX_CONF" > /etc/nginx/conf.d/default.conf'
+                    ' && exec nginx -g "daemon off;"',
+                ],
+                "environment": {
+                    "NGINX_CONF": _PROD_LIKE_NGINX_CONF.replace("$", "$$"),
+                },
+            },
+        },
+    }
+    if "db" in orig_docker_config["services"]:
+        db_config = dict(common_config.get("db", {}), **prod_config.get("db", {}))
+        db_environment = dict(
+            common_config.get("db", {}).get("environment", {}),
+            **prod_config.get("db", {}).get("environment", {}),
+        )
+        docker_config["services"]["db"] = {
+            "environment": {"CONF_EXTRA": db_environment.get("CONF_EXTRA", "")},
+        }
+        if "shm_size" in db_config:
+            docker_config["services"]["db"]["shm_size"] = db_config["shm_size"]
+    if not docker_compose_v2 and orig_docker_config.get("version"):
+        docker_config["version"] = orig_docker_config["version"]
+    file.write(yaml.dump(docker_config))
+    file.flush()
+    return command
+
+
+def _check_resource_limits(c, odoo_command):
+    """Warn if Odoo workers and limits don't fit in its container cgroup."""
+    if isinstance(odoo_command, str):
+        odoo_command = odoo_command.split()
+    flags = dict(flag.partition("=")[::2] for flag in odoo_command[1:])
+    workers = int(flags.get("--workers") or 0)
+    if not workers:
+        return
+    processes = workers + int(flags.get("--max-cron-threads") or 2) + 1
+    soft_limit = int(flags.get("--limit-memory-soft") or 2048 * 2**20)
+    with c.cd(str(PROJECT_ROOT)):
+        # Both cgroup v1 and v2 files are printed in the same order
+        result = c.run(
+            f"{DOCKER_COMPOSE_CMD} exec -T odoo sh -c '"
+            "cat /sys/fs/cgroup/cpu.max /sys/fs/cgroup/memory.max 2>/dev/null"
+            " || cat /sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+            " /sys/fs/cgroup/cpu/cpu.cfs_period_us"
+            " /sys/fs/cgroup/memory/memory.limit_in_bytes;"
+            " nproc; grep MemTotal /proc/meminfo'",
+            env=UID_ENV,
+            hide=True,
+            warn=True,
+        )
+    try:
+        quota, period, memory, nproc, _label, mem_total = result.stdout.split()[:6]
+    except ValueError:
+        _logger.warning("Could not read the cgroup limits of the odoo container")
+        return
+    cpus = int(quota) / int(period) if quota.isdigit() else int(nproc)
+    mem_total = int(mem_total) * 1024
+    memory = min(int(memory), mem_total) if memory.isdigit() else mem_total
+    _logger.info("Odoo container limits: %.1f CPUs and %d MiB", cpus, memory // 2**20)
+    if workers > cpus * 2 + 1:
+        _logger.warning(
+            "%d workers are too many for %.1f CPUs; use %d at most",
+            workers,
+            cpus,
+            cpus * 2 + 1,
+        )
+    if processes * soft_limit > memory:
+        _logger.warning(
+            "%d Odoo processes with --limit-memory-soft=%d may use %d MiB, but the"
+            " container only has %d MiB",
+            processes,
+            soft_limit,
+            processes * soft_limit // 2**20,
+            memory // 2**20,
+        )
 
 
 def _get_cwd_addon(file):
@@ -158,6 +331,355 @@ def _modules_installed(c, modules_list, dbname="devel"):
     return set(filter(None, res.stdout.splitlines()))
 
 
+# Odoo log format: "%(asctime)s %(pid)s %(levelname)s %(dbname)s %(name)s: %(message)s"
+_ODOO_LOG_LINE = re.compile(
+    r"^(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) \d+ \S+ \S+ "
+    r"(?P<logger>[\w.]+): (?P<message>.*)$"
+)
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+_MODULE_LOAD_EVENTS = (
+    ("start", re.compile(r"^Loading module (?P<module>\w+) \(\d+/\d+\)")),
+    ("schema", re.compile(r"^module (?P<module>\w+): creating or updating database")),
+    ("data", re.compile(r"^loading (?P<module>\w+)/(?P<file>\S+)$")),
+    ("end", re.compile(r"^Module (?P<module>\w+) loaded in ")),
+    ("end", re.compile(r"^\d+ modules loaded in ")),
+)
+
+
+def _parse_module_load_log(log):
+    """Get per-module loading times from an Odoo log.
+
+    The log must include `odoo.modules.loading` debug messages. Each module
+    loading time is split in these phases:
+
+    - python: importing the addon code and setting up its models.
+    - schema: creating or updating database tables and columns.
+    - data: loading data files, demo data and running post-init hooks, which
+      Odoo does not log separately.
+    """
+    events = []
+    for line in log.splitlines():
+        match = _ODOO_LOG_LINE.match(_ANSI_ESCAPE.sub("", line).strip())
+        if not match:
+            continue
+        when = datetime.strptime(match["time"], "%Y-%m-%d %H:%M:%S,%f")
+        for kind, regex in _MODULE_LOAD_EVENTS:
+            event = regex.match(match["message"])
+            if event:
+                events.append((when, kind, event.groupdict()))
+                break
+        else:
+            # Any other line still tells us the current phase is not over yet
+            events.append((when, None, {}))
+    modules = {}
+    current = None
+    for index, (when, kind, details) in enumerate(events):
+        if kind == "start":
+            current = modules.setdefault(
+                details["module"],
+                {"total": 0.0, "python": 0.0, "schema": 0.0, "data": 0.0, "files": {}},
+            )
+            phase = "python"
+        elif kind == "end":
+            current = None
+        elif current is not None and kind == "schema":
+            phase = "schema"
+        elif current is not None and kind == "data":
+            phase = "data"
+            data_file = f"{details['module']}/{details['file']}"
+        if current is None or index + 1 == len(events):
+            continue
+        elapsed = (events[index + 1][0] - when).total_seconds()
+        current["total"] += elapsed
+        current[phase] += elapsed
+        if phase == "data":
+            current["files"][data_file] = current["files"].get(data_file, 0) + elapsed
+    return modules
+
+
+def _profile_module_loading(c, odoo_command, report_name):
+    """Run an Odoo command that loads modules and report where time goes.
+
+    A JSON report is stored in `odoo/auto/profiles` and a summary, sorted by
+    total loading time, is printed.
+    """
+    odoo_command += " --log-handler=odoo.modules.loading:DEBUG"
+    with c.cd(str(PROJECT_ROOT)):
+        result = c.run(odoo_command, env=UID_ENV, pty=True)
+    modules = _parse_module_load_log(result.stdout)
+    total = sum(module["total"] for module in modules.values()) or 1
+    ranking = sorted(modules.items(), key=lambda item: item[1]["total"], reverse=True)
+    PROFILES_PATH.mkdir(parents=True, exist_ok=True)
+    report_path = PROFILES_PATH / (
+        f"{report_name}-{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}.json"
+    )
+    with open(report_path, "w") as report_fd:
+        json.dump(
+            {
+                "command": odoo_command,
+                "odoo_version": ODOO_VERSION,
+                "total": total,
+                "modules": dict(ranking),
+            },
+            report_fd,
+            indent=2,
+        )
+        report_fd.write("\n")
+    print(
+        f"{'module':<40} {'total':>9} {'python':>9} {'schema':>9} {'data':>9} {'cum%':>6}"
+    )
+    cumulative = 0.0
+    for name, times in ranking:
+        cumulative += times["total"]
+        print(
+            f"{name:<40} {times['total']:>8.2f}s {times['python']:>8.2f}s "
+            f"{times['schema']:>8.2f}s {times['data']:>8.2f}s "
+            f"{cumulative * 100 / total:>5.1f}%"
+        )
+    _logger.info("Module loading profile saved in %s", report_path)
+    return report_path
+
+
+# (phase, file pattern, function pattern) to find in boot profiles; each phase
+# gets the time spent in matching functions when called from non-matching ones
+_BOOT_PHASES = (
+    ("imports", r"/odoo/modules/module\.py$", r"^load_openerp_module$"),
+    ("module graph", r"/odoo/modules/(module_)?graph\.py$", r""),
+    ("model setup", r"/odoo/(modules|orm)/registry\.py$", r"^(load|setup_models)$"),
+    ("field computation", r"/odoo/(modules|orm)/registry\.py$", r"^init_models$"),
+    ("data files", r"/odoo/tools/convert\.py$", r""),
+    (
+        "asset checks",
+        r"/(ir_asset|ir_qweb|assetsbundle|ir_attachment)\.py$",
+        r"asset|bundle",
+    ),
+)
+_ADDON_PATH = re.compile(r"/addons/(?P<addon>[^/]+)/")
+
+
+def _boot_profile_origin(filename):
+    """Tell the addon, Odoo or Python library owning a profiled file."""
+    match = _ADDON_PATH.search(filename)
+    if match:
+        return match.group("addon")
+    if "/odoo/" in filename:
+        return "odoo (core)"
+    return "python"
+
+
+def _boot_phase_match(func, file_pattern, func_pattern):
+    """Tell if a `pstats` function key belongs to a boot phase."""
+    filename, _line, name = func
+    return bool(re.search(file_pattern, filename) and re.search(func_pattern, name))
+
+
+def _analyze_boot_profile(stats):
+    """Get phases and addons timing from boot `pstats.Stats`."""
+    phases = {}
+    for phase, *patterns in _BOOT_PHASES:
+        phases[phase] = sum(
+            edge[3]
+            for func, (_cc, _nc, _tt, _ct, callers) in stats.stats.items()
+            if _boot_phase_match(func, *patterns)
+            for caller, edge in callers.items()
+            if not _boot_phase_match(caller, *patterns)
+        )
+    modules = {}
+    for (filename, _line, _name), (_cc, _nc, tt, _ct, callers) in stats.stats.items():
+        if filename == "~":
+            # Built-in functions count for whoever calls them
+            for caller, edge in callers.items():
+                origin = _boot_profile_origin(caller[0])
+                modules[origin] = modules.get(origin, 0.0) + edge[2]
+            continue
+        origin = _boot_profile_origin(filename)
+        modules[origin] = modules.get(origin, 0.0) + tt
+    return phases, modules
+
+
+# Written to PROFILES_PATH and used to wrap Odoo when memory profiling; keep it
+# compatible with the oldest Python 3 used by Doodba images
+_MEMPROFILE_SCRIPT = '''\
+"""Run Odoo tracing memory allocations. Generated by `invoke --memprofile`."""
+import atexit
+import json
+import os
+import re
+import runpy
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+import unittest
+
+ADDON = re.compile(r"/addons/([^/]+)/|^odoo\\.addons\\.([^.]+)")
+OUTPUT = os.environ["DOODBA_MEMPROFILE_OUTPUT"]
+INTERVAL = float(os.environ.get("DOODBA_MEMPROFILE_INTERVAL", "0.5"))
+DUMP_INTERVAL = float(os.environ.get("DOODBA_MEMPROFILE_DUMP_INTERVAL", "60"))
+TOP = int(os.environ.get("DOODBA_MEMPROFILE_TOP", "50"))
+MAIN_THREAD = threading.current_thread().ident
+peaks = {"total": 0, "modules": {}, "tests": {}}
+baseline = []
+
+
+def addon_of(text):
+    match = ADDON.search(text)
+    return match and (match.group(1) or match.group(2))
+
+
+def context():
+    """Get the module and test being run by the main thread."""
+    module = test = None
+    frame = sys._current_frames().get(MAIN_THREAD)
+    while frame:
+        obj = frame.f_locals.get("self")
+        if test is None and isinstance(obj, unittest.TestCase):
+            test = obj.id()
+        package = frame.f_locals.get("package")
+        if module is None and frame.f_code.co_name == "load_module_graph":
+            module = getattr(package, "name", None)
+        frame = frame.f_back
+    if module is None and test:
+        module = addon_of(test)
+    return module, test
+
+
+def sample():
+    current, peak = tracemalloc.get_traced_memory()
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    else:
+        peak = current
+    peaks["total"] = max(peaks["total"], peak)
+    for kind, key in zip(("modules", "tests"), context()):
+        if key:
+            peaks[kind][key] = max(peaks[kind].get(key, 0), peak)
+
+
+def sites(stats):
+    return [
+        {
+            "file": stat.traceback[0].filename,
+            "line": stat.traceback[0].lineno,
+            "size": stat.size,
+            "size_diff": getattr(stat, "size_diff", None),
+            "count": stat.count,
+        }
+        for stat in stats[:TOP]
+    ]
+
+
+def dump():
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
+    addons = {}
+    for stat in snapshot.statistics("traceback"):
+        for frame in stat.traceback:
+            addon = addon_of(frame.filename)
+            if addon:
+                addons[addon] = addons.get(addon, 0) + stat.size
+                break
+    report = {
+        "peak": peaks["total"],
+        "modules": peaks["modules"],
+        "tests": peaks["tests"],
+        "addons_live": addons,
+        "top_allocations": sites(snapshot.statistics("lineno")),
+    }
+    if baseline:
+        report["top_growth"] = sites(snapshot.compare_to(baseline[0], "lineno"))
+    else:
+        baseline.append(snapshot)
+    with open(OUTPUT + ".tmp", "w") as fd:
+        json.dump(report, fd, indent=2)
+    os.rename(OUTPUT + ".tmp", OUTPUT)
+
+
+def sampler():
+    last_dump = time.time()
+    while True:
+        time.sleep(INTERVAL)
+        sample()
+        if time.time() - last_dump > DUMP_INTERVAL:
+            dump()
+            last_dump = time.time()
+
+
+tracemalloc.start(int(os.environ.get("DOODBA_MEMPROFILE_FRAMES", "10")))
+threading.Thread(target=sampler, name="memprofile", daemon=True).start()
+atexit.register(dump)
+atexit.register(sample)
+sys.argv = sys.argv[1:]
+sys.argv[0] = shutil.which(sys.argv[0]) or sys.argv[0]
+sys.path[0] = os.path.dirname(os.path.realpath(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name="__main__")
+'''
+
+
+def _memprofile_setup(name):
+    """Prepare memory profiling of an Odoo command.
+
+    Returns the report path in the host, the command prefix that wraps Odoo
+    and the environment it needs.
+    """
+    if ODOO_VERSION < 11:
+        raise exceptions.PlatformError(
+            "Memory profiling needs tracemalloc, only available for Odoo 11+."
+        )
+    PROFILES_PATH.mkdir(parents=True, exist_ok=True)
+    (PROFILES_PATH / "memprofile.py").write_text(_MEMPROFILE_SCRIPT)
+    report_name = f"memprofile-{name}-{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}"
+    return (
+        PROFILES_PATH / f"{report_name}.json",
+        ["python3", "/opt/odoo/auto/profiles/memprofile.py"],
+        {"DOODBA_MEMPROFILE_OUTPUT": f"/opt/odoo/auto/profiles/{report_name}.json"},
+    )
+
+
+def _print_memprofile(report_path, top=10):
+    """Print a summary of a memory profiling report."""
+    with open(report_path) as report_fd:
+        report = json.load(report_fd)
+    print(f"Peak traced memory: {report['peak'] / 2**20:.1f} MiB")
+    for section in ("modules", "tests", "addons_live"):
+        ranking = sorted(report[section].items(), key=lambda item: -item[1])
+        if ranking:
+            print(f"\n{section.replace('_', ' '):<70} {'MiB':>8}")
+        for key, size in ranking[:top]:
+            print(f"{key:<70} {size / 2**20:>8.1f}")
+    print(f"\n{'top allocation sites':<70} {'MiB':>8}")
+    for site in report["top_allocations"][:top]:
+        location = f"{site['file']}:{site['line']}"
+        print(f"{location[-70:]:<70} {site['size'] / 2**20:>8.1f}")
+    _logger.info("Memory profile saved in %s", report_path)
+
+
+def _export_callgrind(stats, path):
+    """Export `pstats.Stats` in callgrind format, with costs in microseconds.
+
+    It can be opened as a call graph with KCachegrind or as a flamegraph with
+    https://www.speedscope.app.
+    """
+    callees = {}
+    for func, (_cc, _nc, _tt, _ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge))
+    with open(path, "w") as fd:
+        fd.write("# callgrind format\nversion: 1\ncreator: invoke boot-profile\n")
+        fd.write("events: Microseconds\n\n")
+        for func, (_cc, _nc, tt, _ct, _callers) in stats.stats.items():
+            filename, line, name = func
+            fd.write(f"fl={filename}\nfn={name}:{line}\n{line} {int(tt * 1e6)}\n")
+            for (cfilename, cline, cname), edge in callees.get(func, ()):
+                fd.write(
+                    f"cfl={cfilename}\ncfn={cname}:{cline}\n"
+                    f"calls={edge[0]} {cline}\n{line} {int(edge[3] * 1e6)}\n"
+                )
+            fd.write("\n")
+
+
 @task
 def write_code_workspace_file(c, cw_path=None):
     """Generate code-workspace file definition.
@@ -521,23 +1043,69 @@ def lint(c, verbose=False):
         c.run(cmd)
 
 
-@task()
-def start(c, detach=True, debugpy=False, _reload=True, port_prefix=0):
+@task(
+    help={
+        "memprofile": "Trace memory allocations of Odoo and dump peaks and top"
+        " allocation sites every minute to a JSON file inside odoo/auto/profiles."
+        " Disables auto-reload. Default: False",
+        "prod-like": "Run Odoo like in production: with workers, production"
+        " limits and Postgres settings, and a proxy that routes the bus to the"
+        " gevent port. Default: False",
+        "workers": "Amount of workers in --prod-like mode. Default: the ones set"
+        " in prod.yaml, or 2",
+    },
+)
+def start(
+    c,
+    detach=True,
+    debugpy=False,
+    _reload=True,
+    port_prefix=0,
+    memprofile=False,
+    prod_like=False,
+    workers=None,
+):
     """Start environment."""
+    if memprofile and debugpy:
+        raise exceptions.ParseError(
+            msg="Memory profiling is not supported in debugging sessions."
+        )
+    if prod_like and (memprofile or debugpy):
+        raise exceptions.ParseError(
+            msg="Production-like mode can't be combined with debugging or"
+            " memory profiling."
+        )
     cmd = DOCKER_COMPOSE_CMD + " up"
     with tempfile.NamedTemporaryFile(
         mode="w",
         suffix=".yaml",
     ) as tmp_docker_compose_file:
-        if debugpy or not _reload:
+        if prod_like:
+            cmd = (
+                DOCKER_COMPOSE_CMD + " -f docker-compose.yml "
+                f"-f {tmp_docker_compose_file.name} up"
+            )
+            odoo_command = _prod_like_override(
+                tmp_docker_compose_file,
+                orig_file=PROJECT_ROOT / "docker-compose.yml",
+                workers=workers,
+            )
+            _logger.info("Starting Odoo with: %s", " ".join(odoo_command))
+        elif debugpy or not _reload or memprofile:
             # Remove auto-reload
             cmd = (
                 DOCKER_COMPOSE_CMD + " -f docker-compose.yml "
                 f"-f {tmp_docker_compose_file.name} up"
             )
+            command_prefix, environment = (), None
+            if memprofile:
+                report_path, command_prefix, environment = _memprofile_setup("start")
+                _logger.info("Memory profile will be saved in %s", report_path)
             _remove_auto_reload(
                 tmp_docker_compose_file,
                 orig_file=PROJECT_ROOT / "docker-compose.yml",
+                command_prefix=command_prefix,
+                environment=environment,
             )
         if detach:
             cmd += " --detach"
@@ -561,6 +1129,13 @@ def start(c, detach=True, debugpy=False, _reload=True, port_prefix=0):
                 restart(c)
         _logger.info("Waiting for services to spin up...")
         time.sleep(SERVICES_WAIT_TIME)
+        if detach:
+            if not prod_like:
+                with open(PROJECT_ROOT / "docker-compose.yml") as fd:
+                    odoo_command = yaml.safe_load(fd.read())["services"]["odoo"].get(
+                        "command", []
+                    )
+            _check_resource_limits(c, odoo_command)
 
 
 @task(
@@ -572,6 +1147,8 @@ def start(c, detach=True, debugpy=False, _reload=True, port_prefix=0):
         "enterprise": "Install all enterprise addons. Default: False",
         "cur-file": "Path to the current file."
         " Addon name will be obtained from there to install.",
+        "profile": "Report the time spent loading each module in a JSON file"
+        " inside odoo/auto/profiles. Default: False",
     },
 )
 def install(
@@ -582,6 +1159,7 @@ def install(
     extra=False,
     private=False,
     enterprise=False,
+    profile=False,
 ):
     """Install Odoo addons
 
@@ -598,6 +1176,17 @@ def install(
                 " See --help for details."
             )
         modules = cur_module
+    if profile:
+        if core or extra or private or enterprise:
+            modules = _get_module_list(c, modules, core, extra, private, enterprise)
+        with c.cd(str(PROJECT_ROOT)):
+            c.run(DOCKER_COMPOSE_CMD + " stop odoo")
+        _profile_module_loading(
+            c,
+            f"{DOCKER_COMPOSE_CMD} run --rm odoo odoo --stop-after-init -i {modules}",
+            "install",
+        )
+        return
     cmd = DOCKER_COMPOSE_CMD + " run --rm odoo addons init"
     if core:
         cmd += " --core"
@@ -618,6 +1207,40 @@ def install(
         )
 
 
+@task(
+    help={
+        "modules": "Comma-separated list of modules to update.",
+        "cur-file": "Path to the current file."
+        " Addon name will be obtained from there to update.",
+        "profile": "Report the time spent loading each module in a JSON file"
+        " inside odoo/auto/profiles. Default: False",
+    },
+)
+def update(c, modules=None, cur_file=None, profile=False):
+    """Update Odoo addons
+
+    By default, updates addon from directory being worked on,
+    unless other options are specified.
+    """
+    if not modules:
+        cur_module = _get_cwd_addon(cur_file or Path.cwd())
+        if not cur_module:
+            raise exceptions.ParseError(
+                msg="Odoo addon to update not found. "
+                "You must provide at least one option for modules"
+                " or be in a subdirectory of one."
+                " See --help for details."
+            )
+        modules = cur_module
+    cmd = f"{DOCKER_COMPOSE_CMD} run --rm odoo odoo --stop-after-init -u {modules}"
+    with c.cd(str(PROJECT_ROOT)):
+        c.run(DOCKER_COMPOSE_CMD + " stop odoo")
+        if not profile:
+            c.run(cmd, env=UID_ENV, pty=True)
+    if profile:
+        _profile_module_loading(c, cmd, "update")
+
+
 @task(
     help={
         "module": "Specific Odoo module to update.",
@@ -862,6 +1485,9 @@ def _get_module_list(
         "db_filter": "DB_FILTER regex to pass to the test container Set to ''"
         " to disable. Default: '^devel$'",
         "tags": "Comma-separated list of tags to test. Default: ',/'.join(modules)",
+        "memprofile": "Trace memory allocations and report peaks per module and"
+        " test, and top allocation sites, in a JSON file inside odoo/auto/profiles."
+        " Default: False",
     },
 )
 def test(
@@ -877,6 +1503,7 @@ def test(
     mode="init",
     db_filter="^devel$",
     tags=None,
+    memprofile=False,
 ):
     """Run Odoo tests
 
@@ -939,20 +1566,33 @@ def test(
         if tags:
             test_tags = tags
         odoo_command.extend(["--test-tags", test_tags])
+    if memprofile:
+        if debugpy:
+            raise exceptions.ParseError(
+                msg="Memory profiling is not supported in debugging sessions."
+            )
+        report_path, command_prefix, environment = _memprofile_setup("test")
+        odoo_command[:0] = command_prefix
     if debugpy:
         _test_in_debug_mode(c, odoo_command)
     else:
         cmd = [DOCKER_COMPOSE_CMD, "run", "--rm"]
         if db_filter:
             cmd.extend(["-e", f"DB_FILTER='{db_filter}'"])
+        if memprofile:
+            cmd.extend(f"-e {key}={value}" for key, value in environment.items())
         cmd.append("odoo")
         cmd.extend(odoo_command)
         with c.cd(str(PROJECT_ROOT)):
-            c.run(
-                " ".join(cmd),
-                env=UID_ENV,
-                pty=True,
-            )
+            try:
+                c.run(
+                    " ".join(cmd),
+                    env=UID_ENV,
+                    pty=True,
+                )
+            finally:
+                if memprofile and report_path.is_file():
+                    _print_memprofile(report_path)
 
 
 @task(
@@ -979,6 +1619,9 @@ def stop(c, purge=False):
         " Default: True",
         "dependencies": "Install only the dependencies of the specified addons."
         "Default: False",
+        "profile": "Report the time spent loading each module in a JSON file"
+        " inside odoo/auto/profiles. It disables the click-odoo-initdb cache."
+        " Default: False",
     },
 )
 def resetdb(
@@ -991,11 +1634,15 @@ def resetdb(
     dbname="devel",
     populate=True,
     dependencies=False,
+    profile=False,
 ):
     """Reset the specified database with the specified modules.
 
     Uses click-odoo-initdb behind the scenes, which has a caching system that
     makes DB resets quicker. See its docs for more info.
+
+    When profiling, the database is always installed from scratch with the
+    native Odoo CLI, to measure the real installation time of each module.
     """
     if dependencies:
         modules = _get_module_dependencies(c, modules, core, extra, private, enterprise)
@@ -1014,7 +1661,14 @@ def resetdb(
         )
         lang = os.getenv("INITIAL_LANG")
         lang_opt = f" --lang {lang}" if lang else ""
-        if ODOO_VERSION >= 19:
+        if profile:
+            lang_opt = f" --load-language={lang}" if lang else ""
+            _profile_module_loading(
+                c,
+                f"{_run} odoo --stop-after-init -d {dbname} -i {modules}{lang_opt}",
+                f"resetdb-{dbname}",
+            )
+        elif ODOO_VERSION >= 19:
             # Odoo 19: Registry.new(force_demo=...) removed → avoid click-odoo-initdb
             # Use native Odoo CLI; --without-demo=all replaces force_demo=False
             lang_opt19 = f" --load-language={lang}" if lang else ""
@@ -1069,6 +1723,173 @@ def restart(c, quick=True):
         c.run(cmd, env=UID_ENV, pty=True)
 
 
+@task(
+    help={
+        "dbname": "The DB whose registry will be loaded. Default: devel",
+        "top": "Amount of addons to show in the summary. Default: 20",
+    },
+)
+def boot_profile(c, dbname="devel", top=20):
+    """Profile Odoo boot until its registry is ready.
+
+    Odoo is started under cProfile and stopped once the registry for the given
+    database is loaded. A summary of the time spent in each boot phase and by
+    each addon is printed, and the raw profile plus a callgrind export are
+    stored in `odoo/auto/profiles`.
+    """
+    PROFILES_PATH.mkdir(parents=True, exist_ok=True)
+    name = f"boot-{dbname}-{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}"
+    prof_path = PROFILES_PATH / f"{name}.prof"
+    with c.cd(str(PROJECT_ROOT)):
+        c.run(DOCKER_COMPOSE_CMD + " stop odoo")
+        started = time.monotonic()
+        c.run(
+            f"{DOCKER_COMPOSE_CMD} run --rm odoo sh -c "
+            f"'python -m cProfile -o /opt/odoo/auto/profiles/{prof_path.name} "
+            f'"$(command -v odoo)" --stop-after-init --workers=0 -d {dbname}\'',
+            env=UID_ENV,
+            pty=True,
+        )
+        wall_time = time.monotonic() - started
+    if not prof_path.is_file():
+        raise exceptions.PlatformError(
+            f"Profile {prof_path} not found. Is odoo/auto mounted in the container?"
+        )
+    stats = pstats.Stats(str(prof_path))
+    phases, modules = _analyze_boot_profile(stats)
+    total = stats.total_tt or 1
+    print(f"Time to ready: {wall_time:.2f}s ({stats.total_tt:.2f}s profiled)")
+    print(f"{'phase':<40} {'time':>9} {'%':>6}")
+    for phase, seconds in phases.items():
+        print(f"{phase:<40} {seconds:>8.2f}s {seconds * 100 / total:>5.1f}%")
+    print(f"\n{'addon':<40} {'self time':>9} {'%':>6}")
+    ranking = sorted(modules.items(), key=lambda item: item[1], reverse=True)
+    for origin, seconds in ranking[: int(top)]:
+        print(f"{origin:<40} {seconds:>8.2f}s {seconds * 100 / total:>5.1f}%")
+    callgrind_path = PROFILES_PATH / f"callgrind.out.{name}"
+    _export_callgrind(stats, callgrind_path)
+    with open(PROFILES_PATH / f"{name}.json", "w") as report_fd:
+        json.dump(
+            {
+                "dbname": dbname,
+                "odoo_version": ODOO_VERSION,
+                "wall_time": wall_time,
+                "profiled_time": stats.total_tt,
+                "phases": phases,
+                "modules": dict(ranking),
+            },
+            report_fd,
+            indent=2,
+        )
+        report_fd.write("\n")
+    _logger.info(
+        "Boot profile saved in %s; open %s in KCachegrind or speedscope",
+        prof_path,
+        callgrind_path,
+    )
+
+
+@task(
+    help={
+        "duration": "Seconds to sample the Odoo process. Default: 30",
+        "url": "Sample only while Odoo serves this URL, instead of for some"
+        " seconds. Paths are requested to the local devel Odoo.",
+        "cookie": "Cookie header to send with --url, e.g. session_id=... copied"
+        " from your browser to profile an authenticated request.",
+        "pid": "Process ID of Odoo inside its container. Default: 1",
+        "rate": "Samples per second. Default: 100",
+        "output-format": "One of speedscope, flamegraph, chrometrace or raw."
+        " Default: speedscope",
+        "native": "Include native extension frames. Default: False",
+    },
+)
+def profile(
+    c,
+    duration=30,
+    url=None,
+    cookie=None,
+    pid=1,
+    rate=100,
+    output_format="speedscope",
+    native=False,
+):
+    """Attach a sampling profiler to the running Odoo process.
+
+    Uses py-spy from the `profiler` service, which shares the PID namespace of
+    the `odoo` service, so Odoo doesn't need to be restarted. The result is
+    stored in `odoo/auto/profiles`.
+    """
+    extensions = {
+        "chrometrace": "json",
+        "flamegraph": "svg",
+        "raw": "txt",
+        "speedscope": "speedscope.json",
+    }
+    if output_format not in extensions:
+        raise exceptions.ParseError(
+            msg=f"Unknown output format {output_format}."
+            f" Use one of: {', '.join(extensions)}."
+        )
+    PROFILES_PATH.mkdir(parents=True, exist_ok=True)
+    name = (
+        f"profile-{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}"
+        f".{extensions[output_format]}"
+    )
+    args = (
+        f"--pid {pid} --rate {rate} --format {output_format} --output {name}"
+        f"{' --native' if native else ''}"
+    )
+    with c.cd(str(PROJECT_ROOT)):
+        if not url:
+            c.run(
+                f"{DOCKER_COMPOSE_CMD} run --rm profiler --duration {duration} {args}",
+                env=UID_ENV,
+                pty=True,
+            )
+        else:
+            _profile_url(c, url, cookie, args)
+    _logger.info("Profile saved in %s", PROFILES_PATH / name)
+
+
+def _profile_url(c, url, cookie, args):
+    """Record a profile only while Odoo serves one request."""
+    if url.startswith("/"):
+        port_prefix = os.environ.get("PORT_PREFIX", int(ODOO_VERSION))
+        url = f"http://localhost:{port_prefix}069{url}"
+    container = f"doodba-profiler-{os.getpid()}"
+    profiler = subprocess.Popen(
+        f"{DOCKER_COMPOSE_CMD} run --rm -T --name {container} profiler {args}",
+        shell=True,
+        cwd=PROJECT_ROOT,
+        env=dict(os.environ, **UID_ENV),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    try:
+        # Wait until py-spy starts sampling
+        for line in profiler.stdout:
+            print(line, end="")
+            if "Sampling process" in line:
+                break
+        else:
+            raise exceptions.PlatformError("The profiler could not start.")
+        request = urllib.request.Request(url, headers={"Cookie": cookie or ""})
+        started = time.monotonic()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        _logger.info("%s answered %s in %.2fs", url, status, time.monotonic() - started)
+    finally:
+        c.run(f"{shutil.which('docker')} kill --signal=INT {container}", warn=True)
+        for line in profiler.stdout:
+            print(line, end="")
+        profiler.wait()
+
+
 @task(
     help={
         "container": "Names of the containers from which logs will be obtained."
@@ -1262,3 +2083,1138 @@ def scaffold(
             env=UID_ENV,
             pty=True,
         )
+
+
+_LOADTEST_SCENARIO = {
+    "steps": [
+        {"type": "page", "path": "/web/login"},
+        {"type": "page", "path": "/web"},
+        {
+            "type": "jsonrpc",
+            "model": "res.partner",
+            "method": "search_read",
+            "args": [[]],
+            "kwargs": {"fields": ["display_name"], "limit": 80},
+        },
+    ]
+}
+
+
+class _LoadtestClient:
+    """Minimal asyncio HTTP/1.1 client with keep-alive and session cookie."""
+
+    def __init__(self, url, timeout):
+        self.url = urllib.parse.urlsplit(url)
+        self.timeout = timeout
+        self.cookie = ""
+        self.streams = None
+
+    async def _connect(self):
+        return await asyncio.wait_for(
+            asyncio.open_connection(
+                self.url.hostname,
+                self.url.port or (443 if self.url.scheme == "https" else 80),
+                ssl=self.url.scheme == "https" or None,
+            ),
+            self.timeout,
+        )
+
+    def _head(self, method, path, headers):
+        lines = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {self.url.netloc}",
+            "User-Agent: doodba-loadtest",
+        ]
+        if self.cookie:
+            lines.append(f"Cookie: {self.cookie}")
+        lines.extend(f"{key}: {value}" for key, value in headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            key, value = line.split(":", 1)
+            key, value = key.lower(), value.strip()
+            if key == "set-cookie" and value.startswith("session_id="):
+                self.cookie = value.split(";", 1)[0]
+            headers[key] = value
+        # HTTP/1.0 servers close connections unless they say otherwise
+        if (
+            status_line.startswith(b"HTTP/1.0")
+            and headers.get("connection", "").lower() != "keep-alive"
+        ):
+            headers["connection"] = "close"
+        if status == 101:
+            return status, headers, b""
+        if "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                body += (await reader.readexactly(size + 2))[:-2]
+                if not size:
+                    break
+        else:
+            body = await reader.read()
+            headers["connection"] = "close"
+        return status, headers, body
+
+    async def request(self, method, path, body=None):
+        """Send a request and return its status code and body."""
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers = {
+                "Content-Type": "application/json",
+                "Content-Length": len(body),
+            }
+        data = self._head(method, path, headers) + (body or b"")
+        reused = self.streams is not None
+        try:
+            status, body = await self._exchange(data)
+        except ConnectionError:
+            # Servers may close idle keep-alive connections before getting the
+            # request, so retry it once in a new connection
+            if not reused:
+                raise
+            status, body = await self._exchange(data)
+        return status, body
+
+    async def _exchange(self, data):
+        """Send raw request data and read its response, connecting if needed."""
+        if not self.streams:
+            self.streams = await self._connect()
+        reader, writer = self.streams
+        try:
+            writer.write(data)
+            status, headers, body = await asyncio.wait_for(
+                self._read_response(reader), self.timeout
+            )
+        except Exception:
+            writer.close()
+            self.streams = None
+            raise
+        if headers.get("connection", "").lower() == "close":
+            writer.close()
+            self.streams = None
+        return status, body
+
+    async def jsonrpc(self, path, params):
+        """Make a JSON-RPC call and return its status code and result."""
+        status, body = await self.request(
+            "POST", path, {"jsonrpc": "2.0", "method": "call", "params": params}
+        )
+        response = json.loads(body or "{}")
+        if "error" in response:
+            raise RuntimeError(response["error"].get("message", "JSON-RPC error"))
+        return status, response.get("result")
+
+    async def hold(self, path, seconds):
+        """Keep a bus connection open like a browser tab does."""
+        reader, writer = await self._connect()
+        try:
+            if ODOO_VERSION >= 16:
+                head = self._head(
+                    "GET",
+                    path,
+                    {
+                        "Connection": "Upgrade",
+                        "Origin": f"{self.url.scheme}://{self.url.netloc}",
+                        "Sec-WebSocket-Key": base64.b64encode(os.urandom(16)).decode(),
+                        "Sec-WebSocket-Version": 13,
+                        "Upgrade": "websocket",
+                    },
+                )
+            else:
+                body = json.dumps(
+                    {"jsonrpc": "2.0", "method": "call", "params": {"channels": []}}
+                ).encode()
+                head = self._head(
+                    "POST",
+                    path,
+                    {"Content-Type": "application/json", "Content-Length": len(body)},
+                )
+                head += body
+            writer.write(head)
+            try:
+                status, _headers, _body = await asyncio.wait_for(
+                    self._read_response(reader), seconds
+                )
+            except asyncio.TimeoutError:
+                # Long polling answers when there are notifications or on timeout
+                return 200
+            if status == 101:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(reader.read(), seconds)
+            return status
+        finally:
+            writer.close()
+
+
+async def _loadtest_step(client, step):
+    """Run one scenario step and return its HTTP status code."""
+    kind = step.get("type", "page")
+    if kind == "page":
+        status, _body = await client.request(step.get("method", "GET"), step["path"])
+    elif kind == "jsonrpc":
+        params = step.get("params")
+        if params is None:
+            params = {
+                "model": step["model"],
+                "method": step["method"],
+                "args": step.get("args", []),
+                "kwargs": step.get("kwargs", {}),
+            }
+        path = step.get("path")
+        if not path:
+            path = f"/web/dataset/call_kw/{params['model']}/{params['method']}"
+        status, _result = await client.jsonrpc(path, params)
+    elif kind == "longpolling":
+        default_path = "/websocket" if ODOO_VERSION >= 16 else "/longpolling/poll"
+        status = await client.hold(step.get("path", default_path), step.get("hold", 5))
+    else:
+        raise exceptions.ParseError(msg=f"Unknown loadtest step type {kind}.")
+    return status
+
+
+async def _loadtest_user(url, scenario, credentials, deadline, timeout, samples):
+    """Virtual user that logs in and loops over the scenario until deadline."""
+    loop = asyncio.get_running_loop()
+    client = _LoadtestClient(url, timeout)
+    started = loop.time()
+    try:
+        await client.jsonrpc("/web/session/authenticate", credentials)
+        samples.setdefault("login", []).append((loop.time() - started, True))
+    except Exception as error:
+        samples.setdefault("login", []).append((loop.time() - started, False))
+        _logger.warning("Login failed: %s", error)
+        return
+    while loop.time() < deadline:
+        for step in scenario["steps"]:
+            if loop.time() >= deadline:
+                break
+            name = (
+                step.get("name")
+                or (
+                    f"{step.get('type', 'page')} "
+                    f"{step.get('path') or step.get('model', '')}"
+                    f"{'.' + step['method'] if 'model' in step else ''}"
+                ).strip()
+            )
+            started = loop.time()
+            try:
+                ok = await _loadtest_step(client, step) < 400
+            except (EOFError, OSError, ValueError, RuntimeError, asyncio.TimeoutError):
+                ok = False
+            samples.setdefault(name, []).append((loop.time() - started, ok))
+
+
+def _percentile(values, percent):
+    """Get the nearest-rank percentile of a sorted list."""
+    return values[max(0, -(-len(values) * percent // 100) - 1)]
+
+
+def _loadtest_stats(samples, duration):
+    """Summarize `(latency, ok)` samples."""
+    latencies = sorted(latency for latency, _ok in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _latency, ok in samples if not ok),
+        "rps": len(samples) / duration,
+        "mean": sum(latencies) / len(latencies),
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "p99": _percentile(latencies, 99),
+    }
+
+
+@task(
+    help={
+        "url": "Base URL of Odoo. Default: the odoo_proxy port of the devel"
+        " environment. Use your Traefik route to test a deployed stack.",
+        "scenario": "Path to a JSON scenario file. See docs for its format."
+        " Default: load login and backend pages and read partners.",
+        "users": "Concurrent virtual users. Default: 10",
+        "duration": "Seconds to run the load test. Default: 30",
+        "timeout": "Seconds before a request counts as failed. Default: 30",
+        "dbname": "Database to log in. Default: devel",
+        "login": "User login. Default: admin",
+        "password": "User password. Default: admin",
+        "compare": "Path to a previous results file to compare with.",
+    },
+)
+def loadtest(
+    c,
+    url=None,
+    scenario=None,
+    users=10,
+    duration=30,
+    timeout=30,
+    dbname="devel",
+    login="admin",
+    password="admin",
+    compare=None,
+):
+    """Generate HTTP load against Odoo and report throughput and latencies.
+
+    Every virtual user logs in and runs the scenario steps in a loop. Results
+    are saved as JSON inside `odoo/auto/profiles`, along with the current git
+    commit, to compare runs.
+    """
+    if not url:
+        port_prefix = os.environ.get("PORT_PREFIX", int(ODOO_VERSION))
+        url = f"http://localhost:{port_prefix}069"
+    url = url.rstrip("/")
+    if scenario:
+        with open(scenario) as scenario_fd:
+            steps = json.load(scenario_fd)
+    else:
+        steps = _LOADTEST_SCENARIO
+    credentials = {"db": dbname, "login": login, "password": password}
+    samples = {}
+
+    async def _run():
+        deadline = asyncio.get_running_loop().time() + float(duration)
+        await asyncio.gather(
+            *(
+                _loadtest_user(url, steps, credentials, deadline, timeout, samples)
+                for _user in range(int(users))
+            )
+        )
+
+    _logger.info("Loading %s with %s users for %ss...", url, users, duration)
+    started = time.monotonic()
+    asyncio.run(_run())
+    elapsed = time.monotonic() - started
+    if not samples.get("login") or not any(ok for _lat, ok in samples["login"]):
+        raise exceptions.PlatformError(f"Could not log in {dbname} at {url}.")
+    with c.cd(str(PROJECT_ROOT)):
+        result = c.run("git rev-parse HEAD", hide=True, warn=True)
+    commit = result.stdout.strip() if result.ok else None
+    results = {
+        "commit": commit,
+        "date": datetime.now().isoformat(),
+        "url": url,
+        "users": int(users),
+        "duration": elapsed,
+        "scenario": steps,
+        "endpoints": {
+            name: _loadtest_stats(endpoint, elapsed)
+            for name, endpoint in samples.items()
+        },
+        "total": _loadtest_stats(
+            [
+                sample
+                for name, endpoint in samples.items()
+                if name != "login"
+                for sample in endpoint
+            ]
+            or [(0.0, False)],
+            elapsed,
+        ),
+    }
+    previous, previous_label = {}, ""
+    if compare:
+        with open(compare) as compare_fd:
+            previous = json.load(compare_fd)
+        previous_label = f"  vs {(previous['commit'] or previous['date'])[:19]}"
+        previous = dict(previous["endpoints"], total=previous["total"])
+    print(
+        f"{'endpoint':<50} {'reqs':>6} {'errs':>5} {'rps':>7} "
+        f"{'p50':>7} {'p95':>7} {'p99':>7}"
+    )
+    for name, stats in chain(
+        results["endpoints"].items(), [("total", results["total"])]
+    ):
+        print(
+            f"{name[-50:]:<50} {stats['requests']:>6} {stats['errors']:>5} "
+            f"{stats['rps']:>7.1f} {stats['p50'] * 1000:>5.0f}ms "
+            f"{stats['p95'] * 1000:>5.0f}ms {stats['p99'] * 1000:>5.0f}ms"
+        )
+        if name in previous:
+            old = previous[name]
+            print(
+                f"{previous_label:<50} {old['requests']:>6} {old['errors']:>5} "
+                f"{old['rps']:>7.1f} {old['p50'] * 1000:>5.0f}ms "
+                f"{old['p95'] * 1000:>5.0f}ms {old['p99'] * 1000:>5.0f}ms"
+            )
+    PROFILES_PATH.mkdir(parents=True, exist_ok=True)
+    results_path = PROFILES_PATH / (
+        f"loadtest-{(commit or 'nogit')[:8]}-"
+        f"{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}.json"
+    )
+    with open(results_path, "w") as results_fd:
+        json.dump(results, results_fd, indent=2)
+        results_fd.write("\n")
+    _logger.info("Load test results saved in %s", results_path)
+
+
+_REPLICA_LAG_QUERY = """
+SELECT
+    (SELECT status FROM pg_stat_wal_receiver),
+    CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END,
+    pg_wal_lsn_diff(pg_last_wal_receive_lsn(), pg_last_wal_replay_lsn())
+WHERE pg_is_in_recovery()
+"""
+
+
+@task(
+    help={
+        "max-seconds": "Fail if the replica lags more than these seconds. Default: 60",
+    },
+)
+def replica_lag(c, max_seconds=60):
+    """Check how far the production database replica lags behind its primary.
+
+    Fails if the replica is down, doesn't stream from the primary or lags too
+    much, so you can use it in monitoring checks. While the replica is down,
+    Odoo sends its read-only requests to the primary.
+    """
+    common = yaml.safe_load((PROJECT_ROOT / "common.yaml").read_text())
+    user = common["services"]["db"]["environment"]["POSTGRES_USER"]
+    with c.cd(str(PROJECT_ROOT)):
+        result = c.run(
+            f"{DOCKER_COMPOSE_CMD} -f prod.yaml exec -T db_replica"
+            f" psql -U {user} -d postgres -tA -F '|'"
+            f" -c '{' '.join(_REPLICA_LAG_QUERY.split())}'",
+            hide=True,
+            warn=True,
+        )
+    if not result.ok:
+        raise exceptions.PlatformError(
+            f"Could not query the replica: {result.stderr.strip()}"
+        )
+    if not result.stdout.strip():
+        raise exceptions.PlatformError("The replica is not in recovery mode.")
+    status, seconds, pending_bytes = result.stdout.strip().split("|")
+    seconds = float(seconds)
+    _logger.info(
+        "Replica %s, %.1fs behind, %s bytes of WAL pending to replay",
+        status or "not streaming",
+        seconds,
+        pending_bytes,
+    )
+    if status != "streaming":
+        raise exceptions.PlatformError("The replica is not streaming WAL.")
+    if seconds > float(max_seconds):
+        raise exceptions.PlatformError(
+            f"The replica lags {seconds:.1f}s, more than {max_seconds}s."
+        )
+
+
+@task(
+    help={
+        "target-time": "Restore the database as it was at this moment, in ISO"
+        " format, like '2024-05-31 10:00:00+02:00'. Without offset, it is UTC."
+        " Default: the latest moment backed up.",
+    },
+)
+def restore_pitr(c, target_time=None):
+    """Restore the production database to a point in time.
+
+    Run it in the production host, with backup_mode=pitr. It stops the
+    production services, restores the latest base backup finished before the
+    target time from the `backup_pitr` service, replays the WAL archived since
+    then, and starts everything again.
+
+    The previous database cluster is kept in a `pre-restore-*` folder inside the
+    `db` volume. Remove it when you're happy with the result.
+    """
+    if target_time:
+        target = datetime.fromisoformat(target_time)
+        if not target.tzinfo:
+            target = target.replace(tzinfo=timezone.utc)
+        target = target.astimezone(timezone.utc)
+    else:
+        target = datetime.now(timezone.utc)
+    common = yaml.safe_load((PROJECT_ROOT / "common.yaml").read_text())
+    user = common["services"]["db"]["environment"]["POSTGRES_USER"]
+    pg_version = int(float(common["services"]["db"]["image"].split(":")[-1][:-7]))
+    cmd = f"{DOCKER_COMPOSE_CMD} -f prod.yaml"
+    with c.cd(str(PROJECT_ROOT)):
+        # A base backup is only usable for targets after it finished; older
+        # ones didn't save that time, but their folder was last changed then
+        list_script = (
+            "cd base && for name in *; do"
+            ' [ -e "$name" ] && echo "$name $(cat "$name/end_time" 2> /dev/null'
+            ' || date -u -r "$name" +%Y%m%dT%H%M%SZ)"; done; true'
+        )
+        result = c.run(
+            f"{cmd} run --rm --no-deps --entrypoint sh backup_pitr"
+            f" -c {shlex.quote(list_script)}",
+            hide=True,
+        )
+        base_backups = sorted(
+            name
+            for name, end_time in (
+                line.split() for line in result.stdout.splitlines() if line.strip()
+            )
+            if not name.endswith(".tmp")
+            and datetime.strptime(end_time, "%Y%m%dT%H%M%SZ").replace(
+                tzinfo=timezone.utc
+            )
+            < target
+        )
+        if not base_backups:
+            raise exceptions.PlatformError(
+                f"No base backup had finished before {target.isoformat()}."
+            )
+        base_backup = base_backups[-1]
+        _logger.info("Restoring base backup %s", base_backup)
+        settings = [
+            "restore_command = 'cp /var/lib/postgresql/pitr/wal/%f %p"
+            " || cp /var/lib/postgresql/pitr/wal/%f.partial %p'",
+        ]
+        if target_time:
+            settings += [
+                f"recovery_target_time = '{target.isoformat()}'",
+                "recovery_target_action = 'promote'",
+            ]
+        # Postgres 12 moved recovery settings to the main configuration
+        recovery_file = "postgresql.auto.conf" if pg_version >= 12 else "recovery.conf"
+        pre_restore = f"pre-restore-{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}"
+        pre_restore_path = f'"$PGDATA/{pre_restore}"'
+        script = "\n".join(
+            [
+                "set -e",
+                f"mkdir {pre_restore_path}",
+                'find "$PGDATA" -mindepth 1 -maxdepth 1 ! -name "pre-restore-*"'
+                " -exec mv {} " + pre_restore_path + " ';'",
+                f"tar -xzf /var/lib/postgresql/pitr/base/{base_backup}/base.tar.gz"
+                ' -C "$PGDATA"',
+                *(
+                    f'echo {shlex.quote(setting)} >> "$PGDATA/{recovery_file}"'
+                    for setting in settings
+                ),
+                'touch "$PGDATA/recovery.signal"' if pg_version >= 12 else "",
+                'chown -R postgres:postgres "$PGDATA"',
+                'chmod 700 "$PGDATA"',
+            ]
+        )
+        c.run(f"{cmd} stop", pty=True)
+        c.run(
+            f"{cmd} run --rm --no-deps --entrypoint sh db -c {shlex.quote(script)}",
+            pty=True,
+        )
+        c.run(f"{cmd} up -d db", pty=True)
+        _logger.info("Replaying WAL until %s...", target_time or "the end")
+        psql = f"{cmd} exec -T db psql -U {user} -d postgres -tA"
+        failures = 0
+        while True:
+            time.sleep(10)
+            result = c.run(
+                f"{psql} -c 'SELECT pg_is_in_recovery()'", hide=True, warn=True
+            )
+            if result.ok and result.stdout.strip() == "f":
+                break
+            failures = 0 if result.ok else failures + 1
+            if failures > 30:
+                raise exceptions.PlatformError(
+                    f"The database is not answering. Check `{cmd} logs db`."
+                )
+        if pg_version >= 12:
+            c.run(
+                f"{psql} -c 'ALTER SYSTEM RESET restore_command'"
+                " -c 'ALTER SYSTEM RESET recovery_target_time'"
+                " -c 'ALTER SYSTEM RESET recovery_target_action'"
+                " -c 'SELECT pg_reload_conf()'",
+                hide=True,
+            )
+        c.run(f"{cmd} up -d", pty=True)
+    _logger.info(
+        "Database restored. Check it, and then remove %s from the db volume.",
+        pre_restore,
+    )
+
+
+_REGISTRY_CHECK = """
+print("Registry loaded:", len(env.registry), "models,",
+      env["res.users"].search_count([]), "users")
+"""
+
+
+@task(
+    help={
+        "backup-time": "Verify the backup of this time, in any format that Duplicity"
+        " understands, like '3D' or '2024-05-31'. Default: the latest one.",
+        "dst": "Restore from this Duplicity URL instead of backup_dst, like a"
+        " local copy or a MinIO server.",
+        "keep": "Keep the scratch database and filestore to inspect them.",
+    },
+)
+def verify_backup(c, backup_time=None, dst=None, keep=False):
+    """Verify that the latest production backup can be restored.
+
+    Run it in the production host, with backup_mode=dump. The backup service
+    downloads the backup and restores it into a scratch database and filestore,
+    named like the production ones plus `_verify`, while production keeps
+    running. It loads the database and the filestore at once, checks that
+    modules are installed and attachments have their files, and reports row
+    counts and how fast the restore was. Then Odoo loads the scratch registry.
+    """
+    common = yaml.safe_load((PROJECT_ROOT / "common.yaml").read_text())
+    dbname = common["services"]["backup"]["environment"]["PGDATABASE"]
+    scratch = f"{dbname}_verify"
+    cmd = f"{DOCKER_COMPOSE_CMD} -f prod.yaml"
+    env = "-e VERIFY_KEEP=1"
+    if backup_time:
+        env += f" -e VERIFY_TIME={shlex.quote(backup_time)}"
+    if dst:
+        env += f" -e DST={shlex.quote(dst)}"
+    with c.cd(str(PROJECT_ROOT)):
+        try:
+            c.run(f"{cmd} exec -T {env} backup sh /usr/local/bin/backup-verify")
+            c.run(
+                f"printf %s {shlex.quote(_REGISTRY_CHECK)}"
+                f" | {cmd} run --rm --no-deps -T -l traefik.enable=false odoo"
+                f" click-odoo --log-level warn -d {scratch}"
+            )
+        finally:
+            if not keep:
+                c.run(
+                    f"{cmd} exec -T backup sh -c"
+                    f" 'dropdb --if-exists {scratch}"
+                    f" && rm -rf /mnt/backup/src/odoo/filestore/{scratch}'",
+                )
+    _logger.info("Backup verified.")
+
+
+@task(
+    help={
+        "dbname": "Restore into this database and its filestore. Default: 'devel'.",
+        "backup-time": "Restore the backup of this time, in any format that"
+        " Duplicity understands, like '3D' or '2024-05-31'. Default: the latest"
+        " one.",
+        "jobs": "Tables to load at once, for directory format dumps. Default: as"
+        " many as `backup_dump_jobs`.",
+        "filestore": "Restore the filestore too. Default: yes.",
+    },
+)
+def restore_backup(c, dbname="devel", backup_time=None, jobs=None, filestore=True):
+    """Restore a production backup into the development environment.
+
+    Run it in development, with backup_mode=dump. The `backup` service downloads
+    the backup from backup_dst and replaces the database and filestore named
+    `dbname` with it. Duplicity writes the filestore straight into its volume,
+    while the database loads at the same time. Plain SQL dumps stream into
+    psql; directory dumps are downloaded first, and loaded with several jobs.
+
+    Restore into another `dbname` to keep your current database side by side.
+    """
+    if not (PROJECT_ROOT / ".docker" / "backup-restore.sh").exists():
+        raise exceptions.PlatformError(
+            "Only backups with backup_mode=dump can be restored with this task."
+        )
+    env = (
+        f"-e RESTORE_DB={shlex.quote(dbname)}"
+        f" -e RESTORE_OWNER={UID_ENV['UID']}:{UID_ENV['GID']}"
+    )
+    if backup_time:
+        env += f" -e RESTORE_TIME={shlex.quote(backup_time)}"
+    if jobs:
+        env += f" -e RESTORE_JOBS={int(jobs)}"
+    if not filestore:
+        env += " -e RESTORE_FILESTORE=0"
+    with c.cd(str(PROJECT_ROOT)):
+        c.run(f"{DOCKER_COMPOSE_CMD} up -d db", pty=True)
+        c.run(
+            f"{DOCKER_COMPOSE_CMD} run --rm {env} backup /usr/local/bin/backup-restore",
+            pty=True,
+        )
+    _logger.info("Backup restored into %s.", dbname)
+
+
+# Subsetting deletes rows ignoring foreign keys. Then it deletes, or unlinks
+# when Odoo would do so, the rows that lost their references, until none is left.
+_SUBSET_SQL = """
+SET session_replication_role = replica;
+
+CREATE FUNCTION pg_temp.subset_closure() RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    fk record;
+    dirty regclass[];
+    changed regclass[];
+    amount bigint;
+BEGIN
+    LOOP
+        changed := ARRAY[]::regclass[];
+        FOR fk IN
+            SELECT con.conrelid::regclass AS child, col.attname AS col,
+                col.attnotnull AS not_null, con.confrelid::regclass AS parent,
+                ref.attname AS ref, con.confdeltype AS action
+            FROM pg_constraint con
+            JOIN pg_attribute col
+                ON col.attrelid = con.conrelid AND col.attnum = con.conkey[1]
+            JOIN pg_attribute ref
+                ON ref.attrelid = con.confrelid AND ref.attnum = con.confkey[1]
+            WHERE con.contype = 'f' AND cardinality(con.conkey) = 1
+                AND (dirty IS NULL OR con.confrelid::regclass = ANY (dirty))
+        LOOP
+            IF fk.action IN ('n', 'd') AND NOT fk.not_null THEN
+                EXECUTE format(
+                    'UPDATE %s c SET %I = NULL WHERE %I IS NOT NULL'
+                    ' AND NOT EXISTS (SELECT FROM %s p WHERE p.%I = c.%I)',
+                    fk.child, fk.col, fk.col, fk.parent, fk.ref, fk.col
+                );
+            ELSE
+                EXECUTE format(
+                    'DELETE FROM %s c WHERE %I IS NOT NULL'
+                    ' AND NOT EXISTS (SELECT FROM %s p WHERE p.%I = c.%I)',
+                    fk.child, fk.col, fk.parent, fk.ref, fk.col
+                );
+                GET DIAGNOSTICS amount = ROW_COUNT;
+                IF amount > 0 THEN
+                    changed := changed || fk.child;
+                END IF;
+            END IF;
+        END LOOP;
+        EXIT WHEN cardinality(changed) = 0;
+        -- Only references to tables that lost rows can break now
+        dirty := changed;
+    END LOOP;
+END
+$$;
+
+-- Records linked by model name and ID, without foreign keys
+CREATE FUNCTION pg_temp.subset_references() RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    ref record;
+    model text;
+    model_table regclass;
+BEGIN
+    FOR ref IN
+        SELECT * FROM (
+            VALUES
+                ('ir_attachment', 'res_model'),
+                ('ir_model_data', 'model'),
+                ('mail_activity', 'res_model'),
+                ('mail_followers', 'res_model'),
+                ('mail_message', 'model')
+        ) AS refs (tbl, col)
+        WHERE to_regclass(tbl) IS NOT NULL
+    LOOP
+        FOR model IN EXECUTE format(
+            'SELECT DISTINCT %I FROM %I WHERE %I IS NOT NULL', ref.col, ref.tbl, ref.col
+        ) LOOP
+            model_table := to_regclass(quote_ident(replace(model, '.', '_')));
+            CONTINUE WHEN model_table IS NULL;
+            EXECUTE format(
+                'DELETE FROM %I r WHERE %I = $1 AND res_id IS NOT NULL AND res_id != 0'
+                ' AND NOT EXISTS (SELECT FROM %s t WHERE t.id = r.res_id)',
+                ref.tbl, ref.col, model_table
+            ) USING model;
+        END LOOP;
+    END LOOP;
+END
+$$;
+
+DO $$
+DECLARE
+    companies int[] := string_to_array(
+        nullif(current_setting('subset.companies', true), ''), ','
+    )::int[];
+    since date := nullif(current_setting('subset.since', true), '')::date;
+    sample float := nullif(current_setting('subset.sample', true), '')::float;
+    tbl text;
+    document text[];
+BEGIN
+    IF companies IS NOT NULL THEN
+        -- Keep all users, in the first company kept, and their partners
+        UPDATE res_users SET company_id = companies[1]
+        WHERE company_id != ALL (companies);
+        INSERT INTO res_company_users_rel (cid, user_id)
+        SELECT companies[1], id FROM res_users u
+        WHERE NOT EXISTS (
+            SELECT FROM res_company_users_rel r
+            WHERE r.user_id = u.id AND r.cid = companies[1]
+        );
+        UPDATE res_partner SET company_id = NULL
+        WHERE id IN (SELECT partner_id FROM res_users);
+        FOR tbl IN
+            SELECT c.table_name
+            FROM information_schema.columns c
+            JOIN information_schema.tables t USING (table_schema, table_name)
+            WHERE c.table_schema = 'public' AND c.column_name = 'company_id'
+                AND t.table_type = 'BASE TABLE'
+        LOOP
+            EXECUTE format('DELETE FROM %I WHERE company_id != ALL ($1)', tbl)
+            USING companies;
+        END LOOP;
+        DELETE FROM res_company WHERE id != ALL (companies);
+    END IF;
+    IF since IS NOT NULL AND to_regclass('mail_message') IS NOT NULL THEN
+        DELETE FROM mail_message WHERE date < since;
+    END IF;
+    PERFORM setseed(0.5);
+    -- Documents, whose lines are deleted with them
+    FOREACH document SLICE 1 IN ARRAY ARRAY[
+        ['account_move', 'date'],
+        ['crm_lead', 'create_date'],
+        ['pos_order', 'date_order'],
+        ['project_task', 'create_date'],
+        ['purchase_order', 'date_order'],
+        ['sale_order', 'date_order'],
+        ['stock_move', 'date'],
+        ['stock_picking', 'scheduled_date']
+    ] LOOP
+        CONTINUE WHEN NOT EXISTS (
+            SELECT FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = document[1]
+                AND column_name = document[2]
+        );
+        IF since IS NOT NULL THEN
+            EXECUTE format('DELETE FROM %I WHERE %I < $1', document[1], document[2])
+            USING since;
+        END IF;
+        IF sample IS NOT NULL THEN
+            EXECUTE format('DELETE FROM %I WHERE random() * 100 >= $1', document[1])
+            USING sample;
+        END IF;
+    END LOOP;
+END
+$$;
+
+SELECT pg_temp.subset_closure();
+SELECT pg_temp.subset_references();
+SELECT pg_temp.subset_closure();
+SET session_replication_role = DEFAULT;
+"""
+# Personal data to replace, per table: rows to change, and column expressions.
+# Columns that don't exist in the database are skipped.
+_ANONYMIZE = {
+    "res_partner": (
+        "id NOT IN (SELECT partner_id FROM res_company)",
+        {
+            "name": "'Partner ' || id",
+            "display_name": "'Partner ' || id",
+            "complete_name": "'Partner ' || id",
+            "email": "'partner' || id || '@example.com'",
+            "email_normalized": "'partner' || id || '@example.com'",
+            "phone": "NULL",
+            "mobile": "NULL",
+            "street": "'Street ' || id",
+            "street2": "NULL",
+            "vat": "NULL",
+            "website": "NULL",
+            "comment": "NULL",
+            "signup_token": "NULL",
+        },
+    ),
+    "res_users": (
+        "TRUE",
+        {
+            "login": "CASE"
+            " WHEN id = (SELECT coalesce(max(res_id), 1) FROM ir_model_data"
+            " WHERE module = 'base' AND name = 'user_admin') THEN 'admin'"
+            " WHEN login = '__system__' THEN login"
+            " ELSE 'user' || id END",
+            "password": "NULL",
+            "password_crypt": "NULL",
+            "signature": "NULL",
+            "totp_secret": "NULL",
+            "oauth_access_token": "NULL",
+            "oauth_uid": "NULL",
+        },
+    ),
+    "hr_employee": (
+        "TRUE",
+        {
+            "name": "'Employee ' || id",
+            "work_email": "'employee' || id || '@example.com'",
+            "work_phone": "NULL",
+            "mobile_phone": "NULL",
+            "private_email": "NULL",
+            "private_phone": "NULL",
+            "private_street": "NULL",
+            "birthday": "NULL",
+            "place_of_birth": "NULL",
+            "identification_id": "NULL",
+            "passport_id": "NULL",
+            "ssnid": "NULL",
+            "sinid": "NULL",
+            "permit_no": "NULL",
+            "visa_no": "NULL",
+            "emergency_contact": "NULL",
+            "emergency_phone": "NULL",
+        },
+    ),
+    # Since Odoo 13, employee names are stored copies of their resource names
+    "resource_resource": (
+        "id IN (SELECT resource_id FROM hr_employee)",
+        {
+            "name": "(SELECT 'Employee ' || min(id) FROM hr_employee"
+            " WHERE resource_id = resource_resource.id)",
+        },
+    ),
+    "res_partner_bank": (
+        "TRUE",
+        {
+            "acc_number": "'ACC' || id",
+            "sanitized_acc_number": "'ACC' || id",
+            "acc_holder_name": "NULL",
+        },
+    ),
+    "mail_message": (
+        "TRUE",
+        {"body": "''", "email_from": "NULL", "reply_to": "NULL"},
+    ),
+    # Never send or fetch real emails from a copy
+    "ir_mail_server": ("TRUE", {"active": "FALSE", "smtp_pass": "NULL"}),
+    "fetchmail_server": ("TRUE", {"active": "FALSE", "password": "NULL"}),
+    # Sessions and tokens signed with the production secret must not be valid
+    "ir_config_parameter": (
+        "key IN ('database.secret', 'database.uuid')",
+        {
+            "value": "CASE key WHEN 'database.uuid'"
+            " THEN uuid_in(md5(random()::text)::cstring)::text"
+            " ELSE md5(random()::text) END"
+        },
+    ),
+}
+# Rows to anonymize are found through these columns of other tables
+_ANONYMIZE_REQUIRES = {"resource_resource": "hr_employee.resource_id"}
+# Rows with credentials, logs or emails pending to send
+_ANONYMIZE_DELETE = {
+    "auth_totp_device": "TRUE",
+    # Credentials of integrations, like API keys and OAuth secrets
+    "ir_config_parameter": "key NOT LIKE 'database.%' AND key ILIKE ANY (ARRAY["
+    "'%secret%', '%password%', '%token%', '%api_key%', '%apikey%'])",
+    "mail_mail": "TRUE",
+    "res_users_apikeys": "TRUE",
+    "res_users_log": "TRUE",
+}
+_ADMIN_PASSWORD_SCRIPT = """
+admin = env.ref("base.user_admin", False) or env.ref("base.user_root")
+admin.password = "admin"
+"""
+# Restore the attachments listed in stdin. Each Duplicity restore downloads the
+# volumes that hold the file, so with many files restoring the whole filestore
+# and pruning it is faster.
+_FETCH_FILESTORE_SCRIPT = """
+set -eu
+target="/mnt/backup/src/odoo/filestore/$1"
+fetch() {
+    dup --force ${RESTORE_TIME:+--time "$RESTORE_TIME"} \\
+        --file-to-restore "odoo/filestore/$PGDATABASE$1" restore "$DST" "$2"
+}
+sort -u > /tmp/keep
+rm -rf "$target"
+if [ "$(wc -l < /tmp/keep)" -le "$2" ]; then
+    while read -r name; do
+        mkdir -p "$(dirname "$target/$name")"
+        fetch "/$name" "$target/$name" || echo "Missing attachment $name" >&2
+    done < /tmp/keep
+else
+    fetch "" "$target"
+    cd "$target"
+    find . -type f | sed 's|^\\./||' | sort | comm -23 - /tmp/keep | xargs -r rm -f
+fi
+mkdir -p "$target"
+find "$target" -mindepth 1 -type d -empty -delete
+chown -R "$RESTORE_OWNER" "$target"
+"""
+# Above this amount of attachments, the whole filestore is restored and pruned
+_FETCH_FILESTORE_MAX_FILES = 50
+
+
+def _anonymize_sql(columns):
+    """Get set-based statements to remove personal data from existing columns."""
+    statements = [
+        f"DELETE FROM {table} WHERE {where};"
+        for table, where in _ANONYMIZE_DELETE.items()
+        if f"{table}.id" in columns
+    ]
+    for table, (where, values) in _ANONYMIZE.items():
+        assignments = [
+            f"{column} = {expression}"
+            for column, expression in values.items()
+            if f"{table}.{column}" in columns
+        ]
+        if assignments and _ANONYMIZE_REQUIRES.get(table, f"{table}.id") in columns:
+            statements.append(
+                f"UPDATE {table} SET {', '.join(assignments)} WHERE {where};"
+            )
+    return "\n".join(statements)
+
+
+@task(
+    help={
+        "dump": "Load this production dump instead of the latest backup: a plain"
+        " SQL file, maybe gzipped, a custom format one, or a directory format one.",
+        "filestore": "With --dump, copy attachments from this copy of the"
+        " production filestore.",
+        "backup-time": "Load the backup of this time, in any format that"
+        " Duplicity understands. Default: the latest one.",
+        "companies": "Keep only these company IDs, separated by commas. All users"
+        " are kept, in the first one.",
+        "since": "Drop documents and messages older than this date, like '2024-01-01'.",
+        "sample": "Keep only this percentage of documents, picked at random.",
+        "destination-db": "Name the snapshot like '[DESTINATION_DB]-[CURRENT_DATE]',"
+        " to restore it with `invoke restore-snapshot`. Default: 'devel'.",
+    },
+)
+def anonymized_snapshot(
+    c,
+    dump=None,
+    filestore=None,
+    backup_time=None,
+    companies=None,
+    since=None,
+    sample=None,
+    destination_db="devel",
+):
+    """Make an anonymized, and maybe smaller, snapshot of production data.
+
+    Loads the latest production backup, or a dump, into a new database. Then it
+    keeps only some companies, recent documents or a sample of them, deleting
+    or unlinking whatever references the removed records. It replaces personal
+    data with set-based updates, removes credentials, disables mail servers and
+    sets the admin password to `admin`. Only the attachments still referenced
+    are kept in the filestore.
+
+    The result is a snapshot, to restore with `invoke restore-snapshot`.
+    """
+    snapshot_name = f"{destination_db}-{datetime.now().strftime('%Y_%m_%d-%H_%M')}"
+    settings = {}
+    if companies:
+        settings["companies"] = ",".join(
+            str(int(company)) for company in companies.split(",")
+        )
+    if since:
+        settings["since"] = datetime.strptime(since, "%Y-%m-%d").date().isoformat()
+    if sample:
+        settings["sample"] = str(float(sample))
+    # Commands run from the project root
+    if dump:
+        dump = str(Path(dump).absolute())
+    if filestore:
+        filestore = str(Path(filestore).absolute())
+    common = yaml.safe_load((PROJECT_ROOT / "common.yaml").read_text())
+    user = common["services"]["db"]["environment"]["POSTGRES_USER"]
+    db = f"{DOCKER_COMPOSE_CMD} exec -T db"
+    psql = f"{db} psql -U {user} -d {snapshot_name} -v ON_ERROR_STOP=1 --quiet"
+    with c.cd(str(PROJECT_ROOT)):
+        if dump:
+            c.run(f"{DOCKER_COMPOSE_CMD} up -d db", pty=True)
+            _logger.info("Waiting for services to spin up...")
+            time.sleep(SERVICES_WAIT_TIME)
+            c.run(f"{db} createdb -U {user} {snapshot_name}")
+        if dump and Path(dump).is_dir():
+            # pg_restore reads directory dumps by path, so mount it in the db image
+            restore = (
+                f'PGPASSWORD="$POSTGRES_PASSWORD" exec pg_restore --host db -U {user}'
+                f" --no-owner --no-privileges --exit-on-error"
+                f" --jobs {os.cpu_count() or 1} -d {snapshot_name} /mnt/dump"
+            )
+            _logger.info("Loading %s into %s", dump, snapshot_name)
+            c.run(
+                f"{DOCKER_COMPOSE_CMD} run --rm --no-deps -T"
+                f" -v {shlex.quote(dump)}:/mnt/dump:ro,z --entrypoint sh db"
+                f" -c {shlex.quote(restore)}"
+            )
+        elif dump:
+            with open(dump, "rb") as dump_file:
+                magic = dump_file.read(5)
+            reader = "gunzip -c" if magic.startswith(b"\x1f\x8b") else "cat"
+            loader = (
+                f"{db} pg_restore -U {user} --no-owner --no-privileges"
+                f" -d {snapshot_name}"
+                if magic == b"PGDMP"
+                else psql
+            )
+            _logger.info("Loading %s into %s", dump, snapshot_name)
+            c.run(f"{reader} {shlex.quote(dump)} | {loader}", hide="stdout")
+        else:
+            # Attachments are fetched after subsetting, when few are referenced
+            restore_backup(
+                c, dbname=snapshot_name, backup_time=backup_time, filestore=False
+            )
+        result = c.run(
+            f"{psql} -tA -c \"SELECT table_name || '.' || column_name"
+            " FROM information_schema.columns WHERE table_schema = 'public'\"",
+            hide=True,
+        )
+        sql = "\n".join(
+            [
+                *(
+                    f"SET subset.{name} = '{value}';"
+                    for name, value in settings.items()
+                ),
+                _SUBSET_SQL if settings else "",
+                _anonymize_sql(set(result.stdout.split())),
+            ]
+        )
+        _logger.info("Subsetting and anonymizing %s", snapshot_name)
+        c.run(
+            f"printf %s {shlex.quote(sql)} | {psql} --single-transaction",
+            hide="stdout",
+        )
+        if settings:
+            # Deleted rows still take space, and would be copied with the snapshot
+            c.run(f"{db} vacuumdb -U {user} --full --analyze -d {snapshot_name}")
+        c.run(
+            f"printf %s {shlex.quote(_ADMIN_PASSWORD_SCRIPT)}"
+            f" | {DOCKER_COMPOSE_CMD} run --rm -T -l traefik.enable=false odoo"
+            f" click-odoo --log-level warn -d {snapshot_name}",
+            env=UID_ENV,
+        )
+        if dump and not filestore:
+            referenced = []
+        else:
+            result = c.run(
+                f"{psql} -tA -c 'SELECT DISTINCT store_fname FROM ir_attachment"
+                " WHERE store_fname IS NOT NULL'",
+                hide=True,
+            )
+            referenced = result.stdout.split()
+        if not dump:
+            env = f"-e RESTORE_OWNER={UID_ENV['UID']}:{UID_ENV['GID']}"
+            if backup_time:
+                env += f" -e RESTORE_TIME={shlex.quote(backup_time)}"
+            _logger.info(
+                "Restoring %d referenced attachments into %s",
+                len(referenced),
+                snapshot_name,
+            )
+            with tempfile.NamedTemporaryFile("w") as listing:
+                listing.write("".join(f"{name}\n" for name in referenced))
+                listing.flush()
+                c.run(
+                    f"{DOCKER_COMPOSE_CMD} run --rm -T {env} backup"
+                    f" -c {shlex.quote(_FETCH_FILESTORE_SCRIPT)}"
+                    f" sh {snapshot_name} {_FETCH_FILESTORE_MAX_FILES}"
+                    f" < {listing.name}"
+                )
+        elif filestore:
+            source = Path(filestore)
+            present = [name for name in referenced if (source / name).is_file()]
+            if len(present) < len(referenced):
+                _logger.warning(
+                    "%d referenced attachments are missing in %s",
+                    len(referenced) - len(present),
+                    filestore,
+                )
+            target = f"/var/lib/odoo/filestore/{snapshot_name}"
+            with tempfile.NamedTemporaryFile("w") as listing:
+                listing.write("\n".join(present))
+                listing.flush()
+                c.run(
+                    f"tar -C {shlex.quote(str(source))} -cf - -T {listing.name}"
+                    f" | {DOCKER_COMPOSE_CMD} run --rm -T -l traefik.enable=false"
+                    f" odoo sh -c 'mkdir -p {target} && tar -C {target} -xf -'",
+                    env=UID_ENV,
+                )
+    _logger.info(
+        "Snapshot %s ready. Restore it with `invoke restore-snapshot`.", snapshot_name
+    )
@@ -4,6 +4,7 @@ from pathlib import Path
 
 import pytest
 import requests
+import yaml
 from copier import run_copy
 from packaging import version
 from plumbum import local
@@ -196,3 +197,65 @@ def test_multiple_domains(
             assert "Server" not in bad_response.headers
         finally:
             dc.compose.down(remove_images="local", remove_orphans=True)
+
+
+def test_tls_options_in_traefik(
+    cloned_template: Path,
+    tmp_path: Path,
+    traefik_host: dict,
+):
+    """Traefik 3 accepts the TLS options of domain groups."""
+    if version.parse(traefik_host["traefik_version"]) < version.parse("3"):
+        pytest.skip("TLS options per domain group need Traefik 3")
+    base_domain = traefik_host["hostname"]
+    project_name = uuid.uuid4().hex
+    with local.cwd(tmp_path):
+        run_copy(
+            src_path=str(cloned_template),
+            dst_path=".",
+            data={
+                "domains_prod": [
+                    {
+                        "hosts": [f"main.{base_domain}"],
+                        "cert_resolver": True,
+                        "tls_options": "default",
+                    },
+                ],
+                "odoo_version": 17.0,
+                "postgres_version": DBVER_PER_ODOO[17.0]["latest"],
+                "project_name": project_name,
+                "traefik_version": 3,
+            },
+            vcs_ref="test",
+            defaults=True,
+            overwrite=True,
+            unsafe=True,
+        )
+        labels = yaml.safe_load(Path("prod.yaml").read_text())["services"]["odoo"][
+            "labels"
+        ]
+    # A tiny backend is enough for Traefik to load the rendered routers
+    labels = {
+        label: str(value)
+        for label, value in labels.items()
+        if ".healthcheck." not in label
+    }
+    docker = DockerClient()
+    backend = docker.run(
+        "docker.io/traefik/whoami",
+        ["--port", "8069"],
+        detach=True,
+        labels=labels,
+        name=f"{project_name}-whoami",
+        networks=["inverseproxy_shared"],
+    )
+    try:
+        time.sleep(5)
+        response = requests.get(
+            f"https://main.{base_domain}/web/login",
+            verify=False,
+        )
+        assert response.ok
+        assert "GET /web/login" in response.text
+    finally:
+        docker.remove(backend, force=True)
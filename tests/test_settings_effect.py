@@ -1,6 +1,7 @@
 from pathlib import Path
 
 import pytest
+import yaml
 from copier import run_copy
 from plumbum import local
 from python_on_whales import DockerClient
@@ -136,3 +137,780 @@ def test_dbfilter_custom_odoo_extensions(
         prod = DockerClient(compose_files=["prod.yaml"]).compose.config()
         assert prod.services["odoo"].environment["DB_FILTER"] == "^%d_%h$$"
         assert prod.services["backup"].environment["DBS_TO_INCLUDE"] == "^.*_.*$$"
+
+
+@pytest.mark.parametrize(
+    "cpus, ram_gb, postgres, flags, mem_limit",
+    (
+        (
+            4,
+            8,
+            True,
+            {
+                "--workers": "9",
+                "--max-cron-threads": "2",
+                "--limit-memory-soft": str(512 * 2**20),
+                "--limit-memory-hard": str(640 * 2**20),
+                "--db_maxconn": "7",
+            },
+            "6144m",
+        ),
+        (
+            2,
+            2,
+            False,
+            {
+                "--workers": "2",
+                "--max-cron-threads": "1",
+                "--limit-memory-soft": str(512 * 2**20),
+                "--limit-memory-hard": str(640 * 2**20),
+                "--db_maxconn": "22",
+            },
+            "2048m",
+        ),
+    ),
+)
+def test_resources_autotuning(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+    cpus: int,
+    ram_gb: int,
+    postgres: bool,
+    flags: dict,
+    mem_limit: str,
+):
+    """Odoo workers and limits are computed from the reserved resources."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"]
+            if postgres
+            else "",
+            "resources_prod_cpus": cpus,
+            "resources_prod_ram_gb": ram_gb,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    prod = yaml.safe_load((tmp_path / "prod.yaml").read_text())["services"]["odoo"]
+    test = yaml.safe_load((tmp_path / "test.yaml").read_text())["services"]["odoo"]
+    prod_flags = dict(flag.partition("=")[::2] for flag in prod["command"][1:])
+    assert {key: prod_flags[key] for key in flags} == flags
+    assert prod["cpus"] == cpus
+    assert prod["mem_limit"] == mem_limit
+    # Test environment keeps its defaults
+    assert test["command"] == ["odoo", "--workers=3", "--max-cron-threads=1"]
+    assert "mem_limit" not in test
+
+
+@pytest.mark.parametrize(
+    "storage, random_page_cost, effective_io_concurrency",
+    (("ssd", "1.1", "200"), ("hdd", "4", "2"), ("network", "1.1", "300")),
+)
+def test_postgres_autotuning(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+    storage: str,
+    random_page_cost: str,
+    effective_io_concurrency: str,
+):
+    """Postgres settings are computed from the reserved resources."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "postgres_devel_unsafe_writes": storage == "ssd",
+            "postgres_max_connections": 200,
+            "postgres_storage": storage,
+            "resources_prod_cpus": 8,
+            "resources_prod_ram_gb": 32,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    services = {
+        env: yaml.safe_load((tmp_path / f"{env}.yaml").read_text())["services"]
+        for env in ("common", "devel", "test", "prod")
+    }
+    prod_db = services["prod"]["db"]
+    prod_conf = dict(
+        line.split(" = ") for line in prod_db["environment"]["CONF_EXTRA"].splitlines()
+    )
+    assert prod_db["shm_size"] == "2048m"
+    assert prod_conf["max_connections"] == "200"
+    assert prod_conf["shared_buffers"] == "2048MB"
+    assert prod_conf["effective_cache_size"] == "6144MB"
+    assert prod_conf["work_mem"] == "2621kB"
+    assert prod_conf["random_page_cost"] == random_page_cost
+    assert prod_conf["effective_io_concurrency"] == effective_io_concurrency
+    assert prod_conf["max_parallel_workers"] == "8"
+    assert prod_conf["jit"] == "off"
+    # Odoo connection pools fit in max_connections
+    assert "--db_maxconn=9" in services["prod"]["odoo"]["command"]
+    # Devel trades durability for speed only if asked
+    devel_env = services["devel"]["db"]["environment"]
+    if storage == "ssd":
+        assert "fsync = off" in devel_env["CONF_EXTRA"].splitlines()
+        assert "jit = off" in devel_env["CONF_EXTRA"].splitlines()
+    else:
+        assert "CONF_EXTRA" not in devel_env
+    # Test environment keeps the untuned defaults
+    assert "CONF_EXTRA" not in services["test"]["db"]["environment"]
+    assert services["common"]["db"]["shm_size"] == "4gb"
+
+
+def test_postgres_pooler(
+    cloned_template: Path, supported_odoo_version: float, tmp_path: Path
+):
+    """Production Odoo reaches Postgres through PgBouncer."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "postgres_pooler": True,
+            "resources_prod_cpus": 4,
+            "resources_prod_ram_gb": 8,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    services = yaml.safe_load((tmp_path / "prod.yaml").read_text())["services"]
+    key = services["odoo"]["environment"]["PGHOST"]
+    assert services["pooler"]["networks"]["default"]["aliases"] == [key]
+    assert not services["db"]["networks"]["default"]
+    assert "pooler" in services["odoo"]["depends_on"]
+    ini = (tmp_path / ".docker" / "pgbouncer.ini").read_text().splitlines()
+    assert "postgres = host=db pool_mode=session pool_size=12" in ini
+    assert "pool_mode = transaction" in ini
+    assert "default_pool_size = 12" in ini
+    assert "max_client_conn = 94" in ini
+    assert (tmp_path / ".docker" / "pgbouncer-userlist.txt").read_text() == (
+        '"odoo" "example-db-password"\n'
+    )
+
+
+def test_postgres_pooler_clients(
+    cloned_template: Path, supported_odoo_version: float, tmp_path: Path
+):
+    """PgBouncer accepts the pools of every Odoo container."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "odoo_cron_container": True,
+            "odoo_longpolling_container": True,
+            "odoo_longpolling_replicas": 2,
+            "odoo_queue_job_channels": "root:4",
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "postgres_pooler": True,
+            "resources_prod_cpus": 4,
+            "resources_prod_ram_gb": 8,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    services = yaml.safe_load((tmp_path / "prod.yaml").read_text())["services"]
+    assert "--db_maxconn=9" in services["odoo"]["command"]
+    assert "--db_maxconn=6" in services["odoo_cron"]["command"]
+    assert "--db_maxconn=4" in services["odoo_jobrunner"]["command"]
+    ini = (tmp_path / ".docker" / "pgbouncer.ini").read_text().splitlines()
+    # 10 HTTP processes * 9 + 10 spare, cron 6, job runner 6 * 4, websockets 2 * 16
+    assert "max_client_conn = 162" in ini
+
+
+@pytest.mark.parametrize("traefik_version", (2, 3))
+def test_odoo_replicas(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+    traefik_version: int,
+):
+    """Traefik balances load among production Odoo replicas."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "domains_prod": [{"hosts": ["www.example.com"]}],
+            "odoo_replicas": 3,
+            "odoo_version": supported_odoo_version,
+            "postgres_max_connections": 300,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "resources_prod_cpus": 2,
+            "resources_prod_ram_gb": 4,
+            "traefik_version": traefik_version,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    odoo = yaml.safe_load((tmp_path / "prod.yaml").read_text())["services"]["odoo"]
+    key = f"myproject-odoo-{supported_odoo_version:.1f}-prod".replace(".", "-")
+    health_path = "/web/health" if supported_odoo_version >= 15 else "/web/login"
+    assert odoo["scale"] == 3
+    for service in ("main", "longpolling"):
+        prefix = f"traefik.http.services.{key}-{service}.loadbalancer"
+        assert odoo["labels"][f"{prefix}.healthcheck.path"] == health_path
+    prefix = f"traefik.http.services.{key}-main.loadbalancer.sticky.cookie"
+    assert odoo["labels"][f"{prefix}.name"] == f"{key}-replica"
+    # Connections are shared among replicas
+    assert "--db_maxconn=15" in odoo["command"]
+
+
+@pytest.mark.parametrize("env", ("test", "prod"))
+def test_job_containers(
+    cloned_template: Path, supported_odoo_version: float, tmp_path: Path, env: str
+):
+    """Crons and queue jobs run apart from HTTP workers."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "domains_prod": [{"hosts": ["www.example.com"]}],
+            "domains_test": [{"hosts": ["demo.example.com"]}],
+            "odoo_cron_container": True,
+            "odoo_cron_ram_gb": 1.5,
+            "odoo_jobrunner_ram_gb": 3,
+            "odoo_queue_job_channels": "root.mail:1,root:4",
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            f"resources_{env}_cpus": 4,
+            f"resources_{env}_ram_gb": 6,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    services = yaml.safe_load((tmp_path / f"{env}.yaml").read_text())["services"]
+    assert "--max-cron-threads=0" in services["odoo"]["command"]
+    # Cron threads don't take RAM from HTTP workers: 4608 MiB // 512 - 1 gevent
+    assert "--workers=8" in services["odoo"]["command"]
+    assert services["odoo"]["mem_limit"] == "4608m"
+    cron, jobrunner = services["odoo_cron"], services["odoo_jobrunner"]
+    # Job containers get their own RAM, instead of the whole reservation again
+    assert cron["mem_limit"] == "1536m"
+    assert jobrunner["mem_limit"] == "3072m"
+    assert "cpus" not in cron and "cpus" not in jobrunner
+    assert "--no-http" in cron["command"]
+    assert cron["environment"] == services["odoo"]["environment"]
+    # The job runner is loaded along with configured server-wide modules
+    assert jobrunner["command"][:2] == ["sh", "-c"]
+    assert 'exec "$$@" --load="$$modules"' in jobrunner["command"][2]
+    assert jobrunner["command"][4:] == [
+        "odoo",
+        "--workers=5",
+        "--max-cron-threads=0",
+        # 3072 MiB shared among 5 workers and the gevent process
+        f"--limit-memory-soft={512 * 1024 * 1024}",
+        f"--limit-memory-hard={640 * 1024 * 1024}",
+        "--db_maxconn=4",
+        "--limit-time-cpu=1800",
+        "--limit-time-real=3600",
+    ]
+    assert jobrunner["environment"]["ODOO_QUEUE_JOB_CHANNELS"] == "root.mail:1,root:4"
+    for service in (cron, jobrunner):
+        assert service["labels"] == {"traefik.enable": "false"}
+
+
+@pytest.mark.parametrize("traefik_version", (2, 3))
+def test_longpolling_container(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+    traefik_version: int,
+):
+    """Websockets and longpolling are served by a dedicated, scalable service."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "domains_prod": [{"hosts": ["www.example.com"]}],
+            "odoo_longpolling_container": True,
+            "odoo_longpolling_db_maxconn": 32,
+            "odoo_longpolling_ram_gb": 2,
+            "odoo_longpolling_replicas": 4,
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "traefik_version": traefik_version,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    services = yaml.safe_load((tmp_path / "prod.yaml").read_text())["services"]
+    key = f"myproject-odoo-{supported_odoo_version:.1f}-prod".replace(".", "-")
+    service_port = f"traefik.http.services.{key}-longpolling.loadbalancer.server.port"
+    router_service = f"traefik.http.routers.{key}-longpolling-0.service"
+    # Routers stay with Odoo, but point to the dedicated service
+    assert services["odoo"]["labels"][router_service] == f"{key}-longpolling"
+    assert service_port not in services["odoo"]["labels"]
+    longpolling = services["odoo_longpolling"]
+    assert longpolling["labels"][service_port] == 8072
+    assert longpolling["scale"] == 4
+    assert longpolling["mem_limit"] == "2048m"
+    assert longpolling["command"][:3] == ["odoo", "gevent", "--max-cron-threads=0"]
+    assert "--db_maxconn=32" in longpolling["command"]
+
+
+@pytest.mark.parametrize("traefik_version", (2, 3))
+def test_static_cache(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+    traefik_version: int,
+):
+    """Static files and asset bundles are served by the caching proxy."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "domains_prod": [{"hosts": ["www.example.com"]}],
+            "odoo_cache": True,
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "traefik_version": traefik_version,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    prod = yaml.safe_load((tmp_path / "prod.yaml").read_text())
+    common = yaml.safe_load((tmp_path / "common.yaml").read_text())
+    key = f"myproject-odoo-{supported_odoo_version:.1f}-prod".replace(".", "-")
+    labels = prod["services"]["odoo_cache"]["labels"]
+    router = f"traefik.http.routers.{key}-static-secure-0"
+    assert labels[f"traefik.http.services.{key}-cache.loadbalancer.server.port"] == 80
+    assert labels[f"{router}.service"] == f"{key}-cache"
+    assert "/web/assets/" in labels[f"{router}.rule"]
+    assert "/static/" in labels[f"{router}.rule"]
+    # Until Odoo 15, bundles are attachments
+    assert ("/web/content/" in labels[f"{router}.rule"]) == (
+        supported_odoo_version <= 15
+    )
+    # Above crawler routers, below allowed crawlers
+    assert labels[f"{router}.priority"] == 50
+    assert "odoo_cache" in prod["volumes"]
+    nginx_conf = common["services"]["odoo_cache"]["environment"]["NGINX_CONF"]
+    assert ("|/web/content/" in nginx_conf) == (supported_odoo_version <= 15)
+    assert "proxy_hide_header Set-Cookie;" in nginx_conf
+    assert "js_content stats.report;" in nginx_conf
+
+
+def test_page_cache(
+    cloned_template: Path, supported_odoo_version: float, tmp_path: Path
+):
+    """Anonymous pages are cached, unless visitors have a session."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "domains_prod": [{"hosts": ["www.example.com"]}],
+            "odoo_cache": True,
+            "odoo_page_cache_paths": ["/shop", "/"],
+            "odoo_page_cache_ttl": 30,
+            "odoo_version": supported_odoo_version,
+            "paths_without_crawlers": ["/web", "/website/info"],
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "resources_prod_cpus": 4,
+            "resources_prod_ram_gb": 8,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    prod = yaml.safe_load((tmp_path / "prod.yaml").read_text())["services"]
+    common = yaml.safe_load((tmp_path / "common.yaml").read_text())["services"]
+    key = f"myproject-odoo-{supported_odoo_version:.1f}-prod".replace(".", "-")
+    labels = prod["odoo"]["labels"]
+    # Existing routers go through the caching proxy, except websockets
+    for router in ("main", "forbiddenCrawlers", "allowedCrawlers"):
+        service = labels[f"traefik.http.routers.{key}-{router}-secure-0.service"]
+        assert service == f"{key}-cache"
+        # Cache misses reach Odoo, so they are limited too
+        middlewares = labels[
+            f"traefik.http.routers.{key}-{router}-secure-0.middlewares"
+        ]
+        assert f"{key}-admission" in middlewares
+    service = labels[f"traefik.http.routers.{key}-longpolling-secure-0.service"]
+    assert service == f"{key}-longpolling"
+    nginx_conf = common["odoo_cache"]["environment"]["NGINX_CONF"]
+    assert 'location ~ "^(/shop(/|$$)|/$$)" {' in nginx_conf
+    assert "proxy_cache_valid 200 30s;" in nginx_conf
+    assert "proxy_no_cache $$page_cache_bypass $$http_authorization;" in nginx_conf
+    # Cached pages can get big website form posts and slow renders too
+    server = nginx_conf.split("listen 80;", 1)[1].split("location", 1)[0]
+    assert "client_max_body_size 0;" in server
+    assert "proxy_read_timeout 720s;" in server
+
+
+@pytest.mark.parametrize("traefik_version", (2, 3))
+def test_request_limits(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+    traefik_version: int,
+):
+    """Requests are buffered with limits, and Odoo workers aren't overloaded."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "domains_prod": [{"hosts": ["www.example.com"]}],
+            "odoo_replicas": 2,
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "resources_prod_cpus": 4,
+            "resources_prod_ram_gb": 8,
+            "traefik_max_request_body_mb": 64,
+            "traefik_version": traefik_version,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    prod = yaml.safe_load((tmp_path / "prod.yaml").read_text())["services"]
+    test = yaml.safe_load((tmp_path / "test.yaml").read_text())["services"]
+    key = f"myproject-odoo-{supported_odoo_version:.1f}-prod".replace(".", "-")
+    labels = prod["odoo"]["labels"]
+    middlewares = f"traefik.http.middlewares.{key}"
+    buffering = f"{middlewares}-buffering.buffering"
+    assert labels[f"{buffering}.maxRequestBodyBytes"] == str(64 * 1024 * 1024)
+    assert labels[f"{buffering}.memRequestBodyBytes"] == str(2 * 1024 * 1024)
+    # 9 workers per replica, each with a request in progress and another waiting,
+    # for each router that reaches Odoo
+    assert labels[f"{middlewares}-admission-inflight.inFlightReq.amount"] == 36
+    routers = f"traefik.http.routers.{key}"
+    main_middlewares = labels[f"{routers}-main-secure-0.middlewares"].split(", ")
+    # Requests are rejected before buffering their bodies
+    assert main_middlewares.index(f"{key}-admission") < main_middlewares.index(
+        f"{key}-buffering"
+    )
+    assert (
+        f"{key}-admission" in labels[f"{routers}-allowedCrawlers-secure-0.middlewares"]
+    )
+    assert (
+        f"{key}-admission" not in labels[f"{routers}-longpolling-secure-0.middlewares"]
+    )
+    # Plain HTTP routers only redirect to HTTPS
+    assert f"{key}-admission" not in labels[f"{routers}-main-0.middlewares"]
+    # Test environment has no resources, so its workers are unknown
+    assert not any("admission" in label for label in test["odoo"]["labels"])
+    # Traefik v2.4 doesn't know this option, so it is only set when asked
+    assert not any("minResponseBodyBytes" in label for label in labels)
+
+
+@pytest.mark.parametrize("traefik_version", (2, 3))
+def test_compress_settings(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+    traefik_version: int,
+):
+    """Compression skips small responses and compressed formats."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "domains_prod": [{"hosts": ["www.example.com"]}],
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "traefik_compress_encodings": ["zstd", "gzip"],
+            "traefik_compress_excluded_content_types": ["application/pdf"],
+            "traefik_compress_min_bytes": 2048,
+            "traefik_version": traefik_version,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    prod = yaml.safe_load((tmp_path / "prod.yaml").read_text())
+    key = f"myproject-odoo-{supported_odoo_version:.1f}-prod".replace(".", "-")
+    labels = prod["services"]["odoo"]["labels"]
+    middleware = f"traefik.http.middlewares.{key}-compress.compress"
+    assert middleware not in labels
+    assert labels[f"{middleware}.excludedContentTypes"] == "application/pdf"
+    assert labels[f"{middleware}.minResponseBodyBytes"] == "2048"
+    # Only Traefik v3 can choose encodings
+    if traefik_version == 3:
+        assert labels[f"{middleware}.encodings"] == "zstd,gzip"
+    else:
+        assert f"{middleware}.encodings" not in labels
+
+
+@pytest.mark.parametrize("traefik_version", (2, 3))
+def test_merge_routers(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+    traefik_version: int,
+):
+    """Domain groups that only differ in their hosts share routers."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "domains_prod": [
+                {"hosts": ["a.example.com"]},
+                {"hosts": ["www.a.example.com"], "redirect_to": "a.example.com"},
+                {"hosts": ["b.example.com", "a.example.com"]},
+                {"hosts": ["vpn.example.com"], "cert_resolver": True},
+                {"hosts": [f"{n}.example.com" for n in range(150)]},
+            ],
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "traefik_merge_routers": True,
+            "traefik_version": traefik_version,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    prod = yaml.safe_load((tmp_path / "prod.yaml").read_text())["services"]
+    key = f"myproject-odoo-{supported_odoo_version:.1f}-prod".replace(".", "-")
+    labels = prod["odoo"]["labels"]
+    routers = f"traefik.http.routers.{key}"
+    main_rule = labels[f"{routers}-main-secure-0.rule"]
+    assert "a.example.com" in main_rule
+    assert "b.example.com" in main_rule
+    # Each certificate holds at most 100 hosts
+    assert main_rule.count("`") == 200
+    assert labels[f"{routers}-main-secure-1.rule"].count("`") == 104
+    # Groups with other settings keep their own routers
+    assert f"{routers}-redirect-secure-2.rule" in labels
+    assert "vpn.example.com" in labels[f"{routers}-main-secure-3.rule"]
+    assert not any(label.startswith(f"{routers}-main-4.") for label in labels)
+    assert prod["odoo"]["hostname"] == "a.example.com"
+
+
+def test_tls_options(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+):
+    """Domain groups can use their own TLS options in Traefik 3."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "domains_prod": [
+                {"hosts": ["a.example.com"], "tls_options": "modern@file"},
+                {"hosts": ["b.example.com"]},
+                {"hosts": ["c.example.com"], "cert_resolver": False},
+            ],
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "traefik_version": 3,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    prod = yaml.safe_load((tmp_path / "prod.yaml").read_text())["services"]
+    key = f"myproject-odoo-{supported_odoo_version:.1f}-prod".replace(".", "-")
+    labels = prod["odoo"]["labels"]
+    routers = f"traefik.http.routers.{key}"
+    assert labels[f"{routers}-main-secure-0.tls.options"] == "modern@file"
+    # Only secure routers of that group get them
+    assert f"{routers}-main-0.tls.options" not in labels
+    assert f"{routers}-main-secure-1.tls.options" not in labels
+    assert not any(
+        label.endswith(".tls.options") and "-2." in label for label in labels
+    )
+
+
+def test_postgres_replica(
+    cloned_template: Path, supported_odoo_version: float, tmp_path: Path
+):
+    """Production gets a streaming replica for read-only requests."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "postgres_replica": True,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    prod = yaml.safe_load((tmp_path / "prod.yaml").read_text())
+    services = prod["services"]
+    key = services["odoo"]["environment"]["PGHOST"]
+    replica = services["db_replica"]
+    assert replica["networks"]["default"]["aliases"] == [f"{key}-replica"]
+    assert replica["volumes"] == ["db_replica:/var/lib/postgresql/data"]
+    assert "db_replica" in prod["volumes"]
+    assert "replication" in services["db"]["environment"]["LAN_DATABASES"]
+    # The primary keeps WAL until the replica replays it
+    assert "--slot=replica --write-recovery-conf" in replica["entrypoint"][2]
+    command = services["odoo"].get("command", [])
+    if supported_odoo_version >= 18:
+        assert f"--db_replica_host={key}-replica,{key}" in command
+        assert "--db_replica_port=5432" in command
+        assert "--max-cron-threads=0" not in command
+    else:
+        assert not any(arg.startswith("--db_replica") for arg in command)
+
+
+def test_backup_pitr(
+    cloned_template: Path, supported_odoo_version: float, tmp_path: Path
+):
+    """Point-in-time recovery mode streams WAL instead of dumping databases."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "backup_dst": "file:///here",
+            "backup_mode": "pitr",
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    common = yaml.safe_load((tmp_path / "common.yaml").read_text())["services"]
+    prod = yaml.safe_load((tmp_path / "prod.yaml").read_text())
+    backup_env = common["backup"]["environment"]
+    assert backup_env["JOB_200_WHAT"] == "true"
+    assert backup_env["JOB_350_WHEN"] == "15min"
+    assert "backup_pitr:/mnt/backup/src/pitr" in common["backup"]["volumes"]
+    assert common["backup_pitr"]["volumes"] == ["backup_pitr:/mnt/backup/src/pitr"]
+    assert "pg_receivewal" in common["backup_pitr"]["entrypoint"][2]
+    assert prod["services"]["backup_pitr"]["depends_on"] == ["db"]
+    assert "backup_pitr" in prod["volumes"]
+    db = prod["services"]["db"]
+    assert db["volumes"] == ["backup_pitr:/var/lib/postgresql/pitr:ro"]
+    assert "replication" in db["environment"]["LAN_DATABASES"]
+
+
+def test_backup_parallel_dumps(
+    cloned_template: Path, supported_odoo_version: float, tmp_path: Path
+):
+    """Directory format dumps run in parallel, compressed before Duplicity."""
+    postgres_version = DBVER_PER_ODOO[supported_odoo_version]["latest"]
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "backup_dst": "file:///here",
+            "backup_dump_concurrency": 2,
+            "backup_dump_format": "directory",
+            "backup_dump_jobs": 4,
+            "backup_volsize": 500,
+            "odoo_version": supported_odoo_version,
+            "postgres_version": postgres_version,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    backup = yaml.safe_load((tmp_path / "common.yaml").read_text())["services"][
+        "backup"
+    ]
+    assert backup["environment"]["JOB_200_WHAT"] == "sh /usr/local/bin/backup-dump"
+    assert backup["environment"]["OPTIONS"] == (
+        "--volsize 500 --gpg-options=--compress-algo=none"
+    )
+    assert (
+        "./.docker/backup-dump.sh:/usr/local/bin/backup-dump:ro,z"
+        in (backup["volumes"])
+    )
+    script = (tmp_path / ".docker" / "backup-dump.sh").read_text()
+    assert "xargs -0 -r -n 1 -P 2 " in script
+    compress = "zstd:1" if int(postgres_version) >= 16 else "1"
+    assert f"--jobs 4 --compress {compress} " in script
+
+
+def test_backup_verify(
+    cloned_template: Path, supported_odoo_version: float, tmp_path: Path
+):
+    """The backup service can verify backups by restoring them periodically."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "backup_dst": "file:///here",
+            "backup_dump_format": "directory",
+            "backup_dump_jobs": 3,
+            "backup_verify_when": "weekly",
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    backup = yaml.safe_load((tmp_path / "common.yaml").read_text())["services"][
+        "backup"
+    ]
+    assert backup["environment"]["JOB_900_WHAT"] == "sh /usr/local/bin/backup-verify"
+    assert backup["environment"]["JOB_900_WHEN"] == "weekly"
+    assert (
+        "./.docker/backup-verify.sh:/usr/local/bin/backup-verify:ro,z"
+        in backup["volumes"]
+    )
+    script = (tmp_path / ".docker" / "backup-verify.sh").read_text()
+    assert "pg_restore --jobs 3 " in script
+    assert '"$tmp/$PGDATABASE.dump"' in script
+
+
+def test_backup_restore_devel(
+    cloned_template: Path, supported_odoo_version: float, tmp_path: Path
+):
+    """Development can restore production backups, streaming plain dumps."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "backup_dst": "file:///here",
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    devel = yaml.safe_load((tmp_path / "devel.yaml").read_text())
+    backup = devel["services"]["backup"]
+    assert backup["entrypoint"] == ["sh"]
+    assert backup["profiles"] == ["restore"]
+    assert (
+        "./.docker/backup-restore.sh:/usr/local/bin/backup-restore:ro,z"
+        in backup["volumes"]
+    )
+    assert "backup_cache" in devel["volumes"]
+    script = (tmp_path / ".docker" / "backup-restore.sh").read_text()
+    assert 'mkfifo "$tmp/$PGDATABASE.sql"' in script
+    assert "pg_restore" not in script
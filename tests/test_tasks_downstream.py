@@ -1,3 +1,10 @@
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import marshal
+import pstats
 import re
 import time
 from pathlib import Path
@@ -110,9 +117,12 @@ def test_resetdb(
 
     - img-build
     - git-aggregate
+    - profile
+    - start --prod-like
     - stop --purge
     - snapshot
     - restore-snapshot
+    - anonymized-snapshot
     """
     try:
         with local.cwd(tmp_path):
@@ -183,6 +193,25 @@ def test_resetdb(
             assert _install_status("base") == "installed"
             assert _install_status("purchase") == "uninstalled"
             assert _install_status("sale") == "installed"
+            # Profile the same installation
+            invoke("resetdb", "-m", "sale", "--no-populate", "--profile")
+            reports = list(
+                (tmp_path / "odoo" / "auto" / "profiles").glob("resetdb-devel-*.json")
+            )
+            assert len(reports) == 1
+            report = json.loads(reports[0].read_text())
+            assert {"base", "sale"} <= set(report["modules"])
+            assert report["modules"]["base"]["total"] > 0
+            assert _install_status("sale") == "installed"
+            # Profile booting that database
+            stdout = invoke("boot-profile")
+            assert "Time to ready:" in stdout
+            profiles = tmp_path / "odoo" / "auto" / "profiles"
+            assert len(list(profiles.glob("boot-devel-*.prof"))) == 1
+            assert len(list(profiles.glob("callgrind.out.boot-devel-*"))) == 1
+            report = json.loads(next(profiles.glob("boot-devel-*.json")).read_text())
+            assert report["phases"]["model setup"] > 0
+            assert "sale" in report["modules"]
             # Snapshot current DB
             invoke("snapshot", "--destination-db", "db_with_sale")
             if supported_odoo_version >= 11:
@@ -202,6 +231,36 @@ def test_resetdb(
             # Restore snapshot
             invoke("restore-snapshot", "--snapshot-name", "db_with_sale")
             assert _install_status("sale") == "installed"
+            # Anonymize a dump of it into a new snapshot
+            docker = DockerClient(compose_files=["devel.yaml"])
+            docker.compose.up(["db"], detach=True)
+            dump = tmp_path / "prod.sql"
+            for _i in range(10):
+                try:
+                    dump.write_text(
+                        docker.compose.execute(
+                            "db",
+                            ["sh", "-c", 'pg_dump -U "$POSTGRES_USER" devel'],
+                            tty=False,
+                        )
+                    )
+                    break
+                except DockerException:
+                    time.sleep(2)
+            invoke("anonymized-snapshot", "--dump", dump, "--since", "2000-01-01")
+            invoke("restore-snapshot")
+            assert _install_status("sale") == "installed"
+            admins = docker.compose.run(
+                "odoo",
+                command=[
+                    "psql",
+                    "-tc",
+                    "select count(*) from res_users where login='admin'",
+                ],
+                remove=True,
+                tty=False,
+            )
+            assert admins.strip() == "1"
     finally:
         safe_stop_env(tmp_path / "odoo" / "custom" / "src" / "odoo")
 
@@ -244,6 +303,10 @@ def test_start(
             assert "Reinitialized existing Git repository" in stdout
             assert "pre-commit installed" in stdout
             invoke("start")
+            # Attach the sampling profiler to the running Odoo
+            invoke("profile", "--duration=3")
+            profiles = tmp_path / "odoo" / "auto" / "profiles"
+            assert len(list(profiles.glob("profile-*.speedscope.json"))) == 1
             # Test "--debugpy and wait time call
             safe_stop_env(tmp_path)
             stdout = invoke("start", "--debugpy")
@@ -252,6 +315,13 @@ def test_start(
             docker = DockerClient()
             container_logs = docker.compose.logs("odoo")
             assert "dev=reload" not in container_logs
+            # Test production-like mode
+            safe_stop_env(tmp_path)
+            invoke("start", "--prod-like", "--workers=2")
+            assert socket_is_open("127.0.0.1", int(supported_odoo_version) * 1000 + 69)
+            container_logs = docker.compose.logs("odoo")
+            assert "--workers=2" in container_logs
+            assert "--dev" not in container_logs
     finally:
         safe_stop_env(
             tmp_path,
@@ -351,6 +421,7 @@ def test_test_tasks(
     - stop --purge
     - resetdb --dependencies
     - test [options]
+    - test --memprofile
 
     This test will be skipped for prereleased versions of Doodba
     """
@@ -387,6 +458,27 @@ def test_test_tasks(
             assert _install_status(module_name) == "installed"
             _tests_ran(stdout, supported_odoo_version, module_name)
             if supported_odoo_version >= 11:
+                # Test it again tracing memory allocations
+                stdout = invoke(
+                    "test",
+                    "-m",
+                    module_name,
+                    "--mode",
+                    "update",
+                    "--memprofile",
+                    retcode=None,
+                )
+                assert "Peak traced memory:" in stdout
+                reports = list(
+                    (tmp_path / "odoo" / "auto" / "profiles").glob(
+                        "memprofile-test-*.json"
+                    )
+                )
+                assert len(reports) == 1
+                report = json.loads(reports[0].read_text())
+                assert report["peak"] > 0
+                assert module_name in report["modules"]
+                assert report["top_allocations"]
                 # Prepare environment for all private addons and "test" them
                 with local.cwd(tmp_path / "odoo" / "custom" / "src" / "private"):
                     generate_test_addon(
@@ -465,3 +557,320 @@ def test_test_tasks(
         safe_stop_env(
             tmp_path,
         )
+
+
+def _load_tasks(project_path: Path):
+    """Import the tasks module of a rendered project."""
+    spec = importlib.util.spec_from_file_location(
+        "downstream_tasks", project_path / "tasks.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_loadtest_client(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+):
+    """The loadtest HTTP client reads every kind of response and reuses connections."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={"odoo_version": supported_odoo_version},
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    tasks = _load_tasks(tmp_path)
+    responses = {
+        "/length": b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n"
+        b"Set-Cookie: session_id=abc; Path=/\r\n\r\nhello",
+        "/chunked": b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+        b"3\r\nhel\r\n2\r\nlo\r\n0\r\n\r\n",
+        "/close": b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\nhello",
+        "/http10": b"HTTP/1.0 200 OK\r\nContent-Length: 5\r\n\r\nhello",
+        "/idle": b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello",
+        "/truncated": b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nhello",
+    }
+    connections = []
+
+    async def serve(reader, writer):
+        connections.append(writer)
+        with contextlib.suppress(asyncio.IncompleteReadError, ConnectionError):
+            while True:
+                path = (await reader.readuntil(b"\r\n\r\n")).split()[1].decode()
+                writer.write(responses[path])
+                await writer.drain()
+                # HTTP/1.0 connections are left open, so clients must close them
+                if path == "/http10":
+                    return
+                # Close without notice, like servers do with idle connections
+                if path in {"/close", "/idle", "/truncated"}:
+                    writer.close()
+                    return
+
+    async def run():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = tasks._LoadtestClient(f"http://127.0.0.1:{port}", 5)
+        try:
+            assert await client.request("GET", "/length") == (200, b"hello")
+            assert client.cookie == "session_id=abc"
+            assert await client.request("GET", "/chunked") == (200, b"hello")
+            assert len(connections) == 1
+            assert await client.request("GET", "/close") == (200, b"hello")
+            assert client.streams is None
+            assert await client.request("GET", "/http10") == (200, b"hello")
+            assert client.streams is None
+            assert await client.request("GET", "/idle") == (200, b"hello")
+            assert client.streams is not None
+            # The dead idle connection is replaced transparently
+            assert await client.request("GET", "/length") == (200, b"hello")
+            assert len(connections) == 4
+            with pytest.raises(EOFError):
+                await client.request("GET", "/truncated")
+            assert client.streams is None
+        finally:
+            for writer in connections:
+                writer.close()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(run())
+
+
+def test_loadtest_stats(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+):
+    """Loadtest samples are summarized with nearest-rank percentiles."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={"odoo_version": supported_odoo_version},
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    tasks = _load_tasks(tmp_path)
+    assert tasks._percentile([1, 2, 3, 4], 50) == 2
+    assert tasks._percentile(list(range(1, 101)), 95) == 95
+    assert tasks._percentile(list(range(1, 101)), 99) == 99
+    assert tasks._percentile([7], 99) == 7
+    stats = tasks._loadtest_stats([(0.1, True), (0.3, False), (0.2, True)], 2)
+    assert stats == {
+        "requests": 3,
+        "errors": 1,
+        "rps": 1.5,
+        "mean": pytest.approx(0.2),
+        "p50": 0.2,
+        "p95": 0.3,
+        "p99": 0.3,
+    }
+
+
+def test_parse_module_load_log(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+):
+    """Module loading times are split in phases from a debug log."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={"odoo_version": supported_odoo_version},
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    tasks = _load_tasks(tmp_path)
+    log = "\n".join(
+        [
+            "2024-01-01 10:00:00,000 1 INFO devel odoo.modules.loading: "
+            "Loading module base (1/2)",
+            "2024-01-01 10:00:01,000 1 INFO devel odoo.modules.registry: "
+            "module base: creating or updating database tables",
+            "2024-01-01 10:00:03,000 1 DEBUG devel odoo.modules.loading: "
+            "loading base/data/res_country_data.xml",
+            "2024-01-01 10:00:03,500 1 INFO devel odoo.models: Computing fields",
+            "Traceback lines are ignored",
+            "2024-01-01 10:00:04,000 1 DEBUG devel odoo.modules.loading: "
+            "Module base loaded in 4.00s, 1000 queries",
+            "2024-01-01 10:00:04,000 1 DEBUG devel odoo.modules.loading: "
+            "Loading module sale (2/2)",
+            # Colored logs, as seen with a TTY
+            "2024-01-01 10:00:04,500 1 \x1b[1;32m\x1b[1;49mDEBUG\x1b[0m devel "
+            "odoo.modules.loading: loading sale/views/sale_views.xml",
+            "2024-01-01 10:00:05,000 1 INFO devel odoo.modules.loading: "
+            "2 modules loaded in 5.00s, 1200 queries",
+            "2024-01-01 10:00:09,000 1 INFO devel odoo.modules.loading: "
+            "Modules loaded.",
+        ]
+    )
+    modules = tasks._parse_module_load_log(log)
+    assert modules == {
+        "base": {
+            "total": pytest.approx(4),
+            "python": pytest.approx(1),
+            "schema": pytest.approx(2),
+            "data": pytest.approx(1),
+            "files": {"base/data/res_country_data.xml": pytest.approx(1)},
+        },
+        "sale": {
+            "total": pytest.approx(1),
+            "python": pytest.approx(0.5),
+            "schema": 0,
+            "data": pytest.approx(0.5),
+            "files": {"sale/views/sale_views.xml": pytest.approx(0.5)},
+        },
+    }
+
+
+def test_boot_profile_analysis(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+):
+    """Boot profiles are summarized by phase and addon, and exported for KCachegrind."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={"odoo_version": supported_odoo_version},
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    tasks = _load_tasks(tmp_path)
+    odoo = "/opt/odoo/custom/src/odoo/odoo"
+    server = (f"{odoo}/service/server.py", 10, "preload_registries")
+    setup = (f"{odoo}/modules/registry.py", 80, "load")
+    imports = (f"{odoo}/modules/module.py", 5, "load_openerp_module")
+    addon = ("/opt/odoo/auto/addons/my_addon/models/res_partner.py", 1, "<module>")
+    builtin = ("~", 0, "<built-in method time.sleep>")
+    # Same layout as the files written by cProfile: func: (cc, nc, tt, ct, callers)
+    profile = tmp_path / "boot.prof"
+    profile.write_bytes(
+        marshal.dumps(
+            {
+                server: (1, 1, 0.1, 3.0, {}),
+                setup: (1, 1, 0.5, 2.0, {server: (1, 1, 0.5, 2.0)}),
+                imports: (1, 1, 0.2, 0.9, {server: (1, 1, 0.2, 0.9)}),
+                addon: (1, 1, 0.3, 0.7, {imports: (1, 1, 0.3, 0.7)}),
+                builtin: (2, 2, 0.4, 0.4, {addon: (2, 2, 0.4, 0.4)}),
+            }
+        )
+    )
+    stats = pstats.Stats(str(profile))
+    phases, modules = tasks._analyze_boot_profile(stats)
+    assert phases["imports"] == pytest.approx(0.9)
+    assert phases["model setup"] == pytest.approx(2.0)
+    assert phases["data files"] == 0
+    # Built-in functions count for the addon that calls them
+    assert modules == {
+        "odoo (core)": pytest.approx(0.8),
+        "my_addon": pytest.approx(0.7),
+    }
+    callgrind = tmp_path / "boot.callgrind"
+    tasks._export_callgrind(stats, callgrind)
+    text = callgrind.read_text()
+    assert text.startswith("# callgrind format\n")
+    assert "events: Microseconds\n" in text
+    assert (
+        f"fl={odoo}/modules/module.py\nfn=load_openerp_module:5\n5 200000\n"
+        "cfl=/opt/odoo/auto/addons/my_addon/models/res_partner.py\n"
+        "cfn=<module>:1\ncalls=1 1\n5 700000\n"
+    ) in text
+
+
+def test_anonymize_sql(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+):
+    """Anonymization only touches existing columns, and keeps the admin login."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={"odoo_version": supported_odoo_version},
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    tasks = _load_tasks(tmp_path)
+    columns = {
+        "res_partner.id",
+        "res_partner.name",
+        "res_users.id",
+        "res_users.login",
+        "resource_resource.id",
+        "resource_resource.name",
+    }
+    statements = tasks._anonymize_sql(columns).splitlines()
+    assert statements[0].startswith("UPDATE res_partner SET name = 'Partner ' || id ")
+    assert "email" not in statements[0]
+    assert "THEN 'admin'" in statements[1]
+    assert "WHEN login = '__system__' THEN login" in statements[1]
+    # Missing tables are skipped, and so are resources without employees
+    assert len(statements) == 2
+    statements = tasks._anonymize_sql(
+        columns
+        | {
+            "hr_employee.id",
+            "hr_employee.name",
+            "hr_employee.resource_id",
+            "ir_config_parameter.id",
+            "ir_config_parameter.value",
+            "mail_mail.id",
+        }
+    )
+    assert "DELETE FROM mail_mail WHERE TRUE;" in statements
+    assert "DELETE FROM ir_config_parameter WHERE key NOT LIKE 'database.%'" in (
+        statements
+    )
+    assert "UPDATE hr_employee SET name = 'Employee ' || id WHERE TRUE;" in statements
+    assert (
+        "UPDATE resource_resource SET name = (SELECT 'Employee ' || min(id)"
+        " FROM hr_employee WHERE resource_id = resource_resource.id)"
+        " WHERE id IN (SELECT resource_id FROM hr_employee);"
+    ) in statements
+    assert "WHERE key IN ('database.secret', 'database.uuid');" in statements
+
+
+def test_prod_like_override(
+    cloned_template: Path,
+    supported_odoo_version: float,
+    tmp_path: Path,
+):
+    """Production-like devel mode gets production flags, except its own services."""
+    run_copy(
+        src_path=str(cloned_template),
+        dst_path=str(tmp_path),
+        data={
+            "odoo_version": supported_odoo_version,
+            "postgres_version": DBVER_PER_ODOO[supported_odoo_version]["latest"],
+            "postgres_replica": True,
+            "resources_prod_cpus": 4,
+            "resources_prod_ram_gb": 8,
+        },
+        vcs_ref="test",
+        defaults=True,
+        overwrite=True,
+        unsafe=True,
+    )
+    tasks = _load_tasks(tmp_path)
+    override = io.StringIO()
+    command = tasks._prod_like_override(override, tmp_path / "devel.yaml")
+    assert command[0] == "odoo"
+    assert "--workers=9" in command
+    assert "--limit-time-real=120" in command
+    # Development has no replica to read from
+    assert not any(flag.startswith("--db_replica") for flag in command)
+    assert override.getvalue()